@@ -0,0 +1,128 @@
+"""Benchmarks for the bamboo DataFrame extensions, reporting time and peak memory per operation as JSON.
+
+Run with e.g. `python benchmarks/bamboo_benchmarks.py -o results.json`. Larger frame sizes are skipped for operations
+whose previous size exceeded the time limit."""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from pudzu.sandbox.bamboo import *
+
+NAMES = ["Alice", "Bob", "Carol", "Dave", "Eve", "Frank", "Grace", "Heidi", "Ivan", "Judy", "Mallory", "Niaj", "Olivia", "Peggy", "Rupert", "Sybil"]
+SURNAMES = ["Smith", "Jones", "Williamson", "Brown", "Taylor", "Davies", "Evans", "Wilson", "Thomas", "Johnson", "Roberts", "Robinson"]
+TAGS = list("abcdefghij")
+
+
+def make_frame(rows, seed=0):
+    """Synthetic frame with numeric, string, missing, delimited and tuple columns."""
+    rng = np.random.default_rng(seed)
+    tag_counts = rng.integers(0, 5, rows)
+    tags = [tuple(rng.choice(TAGS, n, replace=False)) for n in tag_counts]
+    surnames = rng.choice(SURNAMES, rows).astype(object)
+    surnames[rng.random(rows) < 0.2] = np.nan
+    return pd.DataFrame(
+        {
+            "name": rng.choice(NAMES, rows),
+            "surname": surnames,
+            "nickname": np.where(rng.random(rows) < 0.5, rng.choice(NAMES, rows), None),
+            "age": rng.integers(0, 100, rows),
+            "score": np.where(rng.random(rows) < 0.1, np.nan, rng.normal(50, 15, rows)),
+            "group": rng.choice(list("ABCDE"), rows),
+            "tagstring": [",".join(t) for t in tags],
+            "tags": tags,
+        }
+    )
+
+
+FILTERS = [
+    "age>30",
+    "name=Alice",
+    "name~'^[A-F]'",
+    "*name~'son$'",
+    "tags#>1",
+    "tagstring>>b",
+    "surname:exists and age<50",
+    "not (score>60 or group=A) and _index_>10",
+]
+
+OPERATIONS = {
+    **{f"filter_rows[{f}]": (lambda f: lambda df: df.filter_rows(f))(f) for f in FILTERS},
+    "filter_rows[callable]": lambda df: df.filter_rows(lambda r: r["age"] > 30),
+    "assign_rows": lambda df: df.assign_rows(decade=lambda r: r["age"] // 10, initials=lambda r: r["name"][0]),
+    "assign_rows[assign_if]": lambda df: df.assign_rows(assign_if="surname:exists", full=lambda r: f"{r['name']} {r['surname']}"),
+    "update_columns": lambda df: df.update_columns(name=str.upper, score=lambda x: round(x, 1)),
+    "update_columns[update_if]": lambda df: df.update_columns(update_if=True, surname=str.lower),
+    "groupby_rows[column]": lambda df: df.groupby_rows("group").size(),
+    "groupby_rows[callable]": lambda df: df.groupby_rows(lambda r: r["age"] // 10).size(),
+    "split_columns": lambda df: df.split_columns("tagstring", ","),
+    "explode_to_columns": lambda df: df.explode_to_columns("tags"),
+    "combine_columns": lambda df: df.combine_columns(["name", "nickname", "surname"]),
+    "reduce[builtin]": lambda df: df[["group", "age", "score"]].groupby("group").reduce(np.mean),
+    "reduce[callable]": lambda df: df[["group", "age", "score"]].groupby("group").reduce(lambda s: s.dropna().iloc[0]),
+}
+
+
+def measure(fn, df, repeat):
+    """Time a function over several repeats, then measure its peak traced memory in a separate run."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(df)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn(df)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"time_min": min(times), "time_mean": sum(times) / len(times), "peak_memory": peak}
+
+
+def run(sizes, operations, repeat=3, max_time=10.0, seed=0):
+    """Run the benchmarks, returning a list of result dicts."""
+    results, too_slow = [], set()
+    for rows in sizes:
+        df = make_frame(rows, seed)
+        for name in operations:
+            result = {"operation": name, "rows": rows}
+            if name in too_slow:
+                result["skipped"] = True
+            else:
+                try:
+                    result.update(measure(OPERATIONS[name], df, repeat))
+                    if result["time_mean"] > max_time:
+                        too_slow.add(name)
+                except Exception as e:
+                    result["error"] = f"{type(e).__name__}: {e}"
+                    too_slow.add(name)
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the bamboo DataFrame extensions")
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", help="frame sizes [1e3 1e4 1e5 1e6]", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("-k", "--operations", type=str, help="only run operations containing this substring", default="")
+    parser.add_argument("-r", "--repeat", type=int, help="timing repeats per operation [3]", default=3)
+    parser.add_argument("-t", "--max-time", type=float, help="skip larger sizes once an operation takes this long [10s]", default=10.0)
+    parser.add_argument("--seed", type=int, help="random seed for the synthetic frames [0]", default=0)
+    parser.add_argument("-o", "--output", type=str, help="JSON output file [stdout]")
+    args = parser.parse_args()
+
+    report = {
+        "environment": {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__, "platform": platform.platform()},
+        "parameters": {"sizes": args.sizes, "repeat": args.repeat, "max_time": args.max_time, "seed": args.seed},
+        "results": run(args.sizes, [k for k in OPERATIONS if args.operations in k], args.repeat, args.max_time, args.seed),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -1,4 +1,3 @@
-import pickle
 import seaborn as sns
 import string
 
@@ -17,21 +16,19 @@ LETTERS = string.ascii_lowercase + ' '
 
 def load_generator(n):
     try:
-        logger.info("Loading ../corpora/{}_{}.p".format(CORPUS, n))
-        with open("../corpora/{}_{}.p".format(CORPUS, n), "rb") as f:
-            return pickle.load(f)
+        logger.info("Loading ../corpora/{}_{}.mkv".format(CORPUS, n))
+        return MultiOrderMarkovGenerator.load("../corpora/{}_{}.mkv".format(CORPUS, n))
     except:
-        logger.info("Training {} {}-grams".format(CORPUS, n))
-        markov = MarkovGenerator(n)
+        logger.info("Training {} 1- to {}-grams".format(CORPUS, n))
+        markov = MultiOrderMarkovGenerator(n)
         for f in tqdm.tqdm(CORPUS.split("-")):
             markov.train_file("../corpora/"+f, encoding=ENCODING, normalise=partial(latin_normalise, letters=LETTERS))
-        logger.info("Saving to ../corpora/{}_{}.p".format(CORPUS, n))
-        with open("../corpora/{}_{}.p".format(CORPUS, n), "wb") as f:
-            pickle.dump(markov, f, pickle.HIGHEST_PROTOCOL)
+        logger.info("Saving to ../corpora/{}_{}.mkv".format(CORPUS, n))
+        markov.save("../corpora/{}_{}.mkv".format(CORPUS, n), letters=LETTERS)
         return markov
 
-g1 = load_generator(1)
-g2 = load_generator(2)
+markov = load_generator(2)
+g1, g2 = markov.orders[1], markov.orders[2]
 
 # Grid chart
 
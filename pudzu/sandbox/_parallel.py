@@ -0,0 +1,20 @@
+import logging
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+logger = logging.getLogger("pudzu")
+
+
+def _choose_pool(payload, executor, what, log=logger):
+    """The Executor class to run some work with: a process pool if the payload can be pickled, otherwise a thread pool
+    (with a warning, unless an executor was specified). Raises a ValueError if the specified executor is a process pool
+    but the payload can't be pickled."""
+    try:
+        pickle.dumps(payload)
+        return ProcessPoolExecutor
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        if isinstance(executor, ProcessPoolExecutor):
+            raise ValueError(f"{what[:1].upper()}{what[1:]} must be picklable to run in a process pool: {e}") from e
+        elif executor is None:
+            log.warning(f"Using threads instead of processes as {what} can't be pickled: {e}")
+        return ThreadPoolExecutor
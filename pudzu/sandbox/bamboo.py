@@ -1,17 +1,38 @@
 import fnmatch
+import functools
 import glob
+import gzip
+import hashlib
+import heapq
+import itertools
+import json
 import logging
 import operator
+import os
+import pickle
 import re
-from contextlib import nullcontext
+import sqlite3
+import threading
+import time
+import types
+import warnings
+import weakref
+from collections import abc, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
 
 import numpy as np
 import pandas as pd
 from pudzu.utils import *
-from pudzu.utils import identity, ignoring_exceptions, ignoring_extra_args, nnn, non, non_string_iterable, optional_import
+from pudzu.utils import identity, ignoring_exceptions, ignoring_extra_args, nnn, non, non_string_iterable, optional_import, raise_exception
+
+from pudzu.sandbox._parallel import _choose_pool
 
 tqdm = optional_import("tqdm")
 pyparsing = optional_import("pyparsing")
+pyarrow = optional_import("pyarrow")
+if pyarrow:
+    import pyarrow.parquet
 
 logger = logging.getLogger("bamboo")
 
@@ -23,73 +44,537 @@ def _tqdm_wrapper(t, func, *args, **kwargs):
     return func(*args, **kwargs)
 
 
+def _iterrows_dtype(df):
+    """The numeric dtype that iterrows (and apply) upcast all-numeric rows to, or None for mixed rows."""
+    dtype = pd.core.dtypes.cast.find_common_type(list(df.dtypes)) if len(df.columns) else None
+    return dtype if isinstance(dtype, np.dtype) and dtype.kind in "biufc" else None
+
+
 def _make_filter(filter):
     return ignoring_extra_args((lambda: True) if filter is None else filter if callable(filter) else FilterExpression.make_filter(filter))
 
 
+class RateLimiter:
+    """Thread-safe rate limiter, spacing out calls to at most a given number per second. Can be shared between calls."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_call = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next call is allowed."""
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+    def limit(self, fn):
+        """Function decorator that waits for the rate limiter before each call."""
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            self.wait()
+            return fn(*args, **kwargs)
+
+        return wrapper
+
+
+def _map_concurrently(fn, args, concurrency, rate_limit=None, t=None):
+    """Map a function over argument tuples using a bounded thread pool and an optional rate limit (either
+    calls per second or a shared RateLimiter), returning the results in order."""
+    if rate_limit is not None:
+        fn = (rate_limit if isinstance(rate_limit, RateLimiter) else RateLimiter(rate_limit)).limit(fn)
+    results = [None] * len(args)
+    with ThreadPoolExecutor(concurrency) as pool:
+        futures = {pool.submit(fn, *a): n for n, a in enumerate(args)}
+        try:
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if t is not None:
+                    t.update(1)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    return results
+
+
+def _function_identity(fn, seen=None):
+    """A digest identifying a function by its name, (where available) bytecode, and the values it captures via closures,
+    defaults and globals, so that edits invalidate cached results. Returns None if any captured value can't be pickled."""
+    seen = {id(fn)} if seen is None else seen | {id(fn)}
+    digest = hashlib.sha1()
+
+    def update(code):
+        digest.update(code.co_code)
+        for c in code.co_consts:
+            update(c) if isinstance(c, types.CodeType) else digest.update(repr(c).encode())
+
+    def names(code):
+        return set(code.co_names).union(*(names(c) for c in code.co_consts if isinstance(c, types.CodeType)))
+
+    def update_value(v):
+        if isinstance(v, types.ModuleType):
+            digest.update(v.__name__.encode())
+        elif isinstance(v, (type, types.BuiltinFunctionType)):
+            digest.update(f"{getattr(v, '__module__', '')}.{v.__qualname__}".encode())
+        elif isinstance(v, (types.FunctionType, partial)):
+            identity = "recursive" if id(v) in seen else _function_identity(v, seen)
+            if identity is None:
+                raise ValueError(f"Can't identify {v}")
+            digest.update(identity.encode())
+        else:
+            digest.update(pickle.dumps(v))
+
+    try:
+        if isinstance(fn, partial):
+            update_value(fn.func)
+            for v in (*fn.args, *sorted(fn.keywords.items())):
+                update_value(v)
+        else:
+            digest.update(f"{getattr(fn, '__module__', '')}.{getattr(fn, '__qualname__', type(fn).__qualname__)}".encode())
+            if hasattr(fn, "__code__"):
+                update(fn.__code__)
+                if isinstance(fn, types.MethodType):
+                    update_value(fn.__self__)
+                for cell in fn.__closure__ or ():
+                    update_value(cell.cell_contents)
+                for v in (*(fn.__defaults__ or ()), *sorted((fn.__kwdefaults__ or {}).items())):
+                    update_value(v)
+                for name in sorted(names(fn.__code__) & set(fn.__globals__)):
+                    digest.update(name.encode())
+                    update_value(fn.__globals__[name])
+            elif not isinstance(fn, types.BuiltinFunctionType):
+                update_value(fn)
+    except Exception:
+        return None
+    return digest.hexdigest()
+
+
+def _row_digest(r):
+    """A digest of a row's contents, falling back to its repr if it can't be pickled."""
+    try:
+        data = pickle.dumps(list(r.items()))
+    except Exception:
+        data = repr(list(r.items())).encode()
+    return hashlib.sha1(data).hexdigest()
+
+
+class RowCache:
+    """Persistent on-disk store of assign_rows results, keyed by column and row index, and validated against a digest of
+    the row contents and the function identity. Results are written as soon as they're calculated, so interrupted runs
+    can be resumed. Hit statistics are for the current process only."""
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = self.misses = self.changes = 0
+        self._connect()
+
+    def _connect(self):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (col TEXT, row TEXT, fn TEXT, digest TEXT, value BLOB, PRIMARY KEY (col, row))")
+
+    def __getstate__(self):
+        return self.path
+
+    def __setstate__(self, path):
+        self.__init__(path)
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def __repr__(self):
+        return f"RowCache({self.path!r}, {self.stats()})"
+
+    def stats(self):
+        """Lookup statistics: hits, misses (for new rows) and changes (for rows or functions that have changed)."""
+        lookups = self.hits + self.misses + self.changes
+        return {"hits": self.hits, "misses": self.misses, "changes": self.changes, "hit_rate": self.hits / lookups if lookups else np.nan}
+
+    def invalidate(self, columns=None, index=None):
+        """Delete the stored results for the given columns and/or row indices (or everything, if neither is specified)."""
+        conditions = {}
+        if columns is not None:
+            conditions["col"] = list(make_iterable(columns))
+        if index is not None:
+            conditions["row"] = [repr(i) for i in (index if non_string_iterable(index) and not isinstance(index, tuple) else [index])]
+        where = " AND ".join(f"{k} IN ({', '.join('?' * len(vs))})" for k, vs in conditions.items())
+        with self.lock:
+            self.db.execute("DELETE FROM results" + (f" WHERE {where}" if where else ""), [v for vs in conditions.values() for v in vs])
+
+    def lookup(self, column, fn, identity, r, i):
+        """Return the stored result for a row, calculating and storing it if it's missing or out of date."""
+        key, digest = repr(i), _row_digest(r)
+        with self.lock:
+            found = self.db.execute("SELECT fn, digest, value FROM results WHERE col=? AND row=?", (column, key)).fetchone()
+            if identity is not None and found is not None and found[:2] == (identity, digest):
+                self.hits += 1
+                return pickle.loads(found[2])
+        value = ignoring_extra_args(fn)(r, i)
+        with self.lock:
+            if identity is None:
+                self.misses += 1
+                return value
+            self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", (column, key, identity, digest, pickle.dumps(value)))
+            if found is None:
+                self.misses += 1
+            else:
+                self.changes += 1
+        return value
+
+    def wrap(self, column, fn):
+        """Row/index function that looks up results in the cache. Functions whose captured values can't be pickled
+        are never cached."""
+        identity = _function_identity(fn)
+        if identity is None:
+            logger.warning(f"Not caching results for column {column} as its function's captured values can't be pickled")
+        return partial(_cached_row_function, self, column, fn, identity)
+
+
+def _cached_row_function(cache, column, fn, identity, r, i):
+    return cache.lookup(column, fn, identity, r, i)
+
+
+_IGNORING_EXCEPTIONS_CODE = ignoring_exceptions(identity).__code__
+
+
+class Profiler:
+    """Per-function profile of the row functions and filters evaluated by assign_rows, update_columns, filter_rows and
+    FilterExpression while profiling is active. Records call counts, timings, exceptions swallowed by ignoring_exceptions
+    (or by filter expression operators) and the slowest rows (or values, for update_columns functions)."""
+
+    def __init__(self, slowest=5):
+        self.slowest = slowest
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stats = {}
+
+    def __repr__(self):
+        return f"Profiler({len(self.stats)} functions)"
+
+    def _entry(self, operation, name):
+        with self.lock:
+            return self.stats.setdefault((operation, name), {"calls": 0, "total_time": 0.0, "exceptions": 0, "slowest": []})
+
+    def swallowed(self):
+        """Record an exception swallowed by the function currently being profiled in this thread."""
+        entry = getattr(self.local, "entry", None)
+        if entry is not None:
+            with self.lock:
+                entry["exceptions"] += 1
+
+    def _recording_swallowed(self, fn):
+        """Replace an ignoring_exceptions wrapper with an equivalent one that also records the exceptions it swallows.
+        Other functions, or wrappers whose closure layout isn't recognised, are returned unchanged (and just timed)."""
+        if getattr(fn, "__code__", None) is not _IGNORING_EXCEPTIONS_CODE:
+            return fn
+        try:
+            cells = dict(zip(fn.__code__.co_freevars, (c.cell_contents for c in fn.__closure__)))
+            inner, handler, exceptions = cells["fn"], cells["handler"], cells["exceptions"]
+        except (KeyError, TypeError, ValueError):
+            return fn
+
+        @functools.wraps(fn)
+        def recording(*args, **kwargs):
+            try:
+                return inner(*args, **kwargs)
+            except exceptions:
+                self.swallowed()
+                return handler(*args, **kwargs) if callable(handler) else handler
+
+        return recording
+
+    def wrap(self, operation, name, fn, row=lambda args: args[1] if len(args) > 1 else None):
+        """Wrap a function so that its calls are recorded, identifying rows using the given argument selector."""
+        entry = self._entry(operation, name)
+        call = ignoring_extra_args(self._recording_swallowed(fn))
+
+        def wrapper(*args):
+            previous, self.local.entry = getattr(self.local, "entry", None), entry
+            start = time.perf_counter()
+            try:
+                return call(*args)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.local.entry = previous
+                with self.lock:
+                    entry["calls"] += 1
+                    entry["total_time"] += elapsed
+                    if self.slowest:
+                        item = (elapsed, entry["calls"], row(args))
+                        if len(entry["slowest"]) < self.slowest:
+                            heapq.heappush(entry["slowest"], item)
+                        else:
+                            heapq.heappushpop(entry["slowest"], item)
+
+        return wrapper
+
+    def report(self):
+        """DataFrame report of the recorded functions, sorted by total time. Slowest rows are (row, seconds) pairs."""
+        with self.lock:
+            rows = [
+                {
+                    "operation": operation,
+                    "function": name,
+                    "calls": entry["calls"],
+                    "total_time": entry["total_time"],
+                    "mean_time": entry["total_time"] / entry["calls"] if entry["calls"] else np.nan,
+                    "exceptions": entry["exceptions"],
+                    "slowest": [(r, t) for t, _, r in sorted(entry["slowest"], reverse=True)],
+                }
+                for (operation, name), entry in self.stats.items()
+            ]
+        columns = ["operation", "function", "calls", "total_time", "mean_time", "exceptions", "slowest"]
+        return pd.DataFrame(rows, columns=columns).sort_values("total_time", ascending=False, ignore_index=True)
+
+
+_profiler = None
+
+
+@contextmanager
+def profiling(slowest=5):
+    """Context manager that profiles bamboo row operations, yielding a Profiler whose report() returns a DataFrame.
+    Operations run in worker processes (via workers or executor) aren't profiled."""
+    global _profiler
+    previous, _profiler = _profiler, Profiler(slowest)
+    try:
+        yield _profiler
+    finally:
+        _profiler = previous
+
+
+def _profiled(operation, name, fn, **kwargs):
+    """Wrap a function for the active profiler, if there is one."""
+    return _profiler.wrap(operation, name, fn, **kwargs) if _profiler is not None and callable(fn) else fn
+
+
 def _filter_rows(df, filter):
-    """Filter rows using either a row/index predicate or a RecordFilter expression. Slower than boolean indexing."""
-    filter_fn = _make_filter(filter)
+    """Filter rows using either a row/index predicate or a RecordFilter expression. Filter expressions are evaluated
+    column-wise; predicates are evaluated row by row, which is slower than boolean indexing."""
+    if isinstance(filter, str):
+        return df[FilterExpression.make_mask(filter)(df).values]
+    filter_fn = _make_filter(_profiled("filter_rows", "filter", filter))
     return df[[filter_fn(r, i) for i, r in df.iterrows()]]
 
 
-def _assign_rows(df, progressbar=False, assign_if=None, **kwargs):
-    """Assign or update columns using row/index function, with an optional row/index predicate condition. Progress bars require tqdm."""
-    filter_fn = _make_filter(assign_if)
-    if progressbar and tqdm:
-        t = tqdm.tqdm(total=len(df) * len(kwargs))
-        filter_fn = partial(_tqdm_wrapper, t, filter_fn)
+def _assign_column(df, k, fn, filter_fn):
+    return [(ignoring_extra_args(fn)(r, i) if callable(fn) else fn) if filter_fn(r, i) else r.get(k) for i, r in df.iterrows()]
+
+
+def _assign_column_concurrently(df, k, fn, filter_fn, concurrency, rate_limit, t):
+    rows = list(df.iterrows())
+    selected = [bool(filter_fn(r, i)) for i, r in rows]
+    if t is not None:
+        t.update(selected.count(False))
+    values = iter(_map_concurrently(ignoring_extra_args(fn), [(r, i) for (i, r), s in zip(rows, selected) if s], concurrency, rate_limit, t))
+    return [next(values) if s else r.get(k) for (i, r), s in zip(rows, selected)]
+
+
+def _assign_rows(df, progressbar=False, assign_if=None, workers=None, executor=None, concurrency=None, rate_limit=None, checkpoint=None, **kwargs):
+    """Assign or update columns using row/index function, with an optional row/index predicate condition. Progress bars require tqdm.
+    Rows can be processed in parallel chunks by specifying a number of worker processes and/or an Executor. Alternatively,
+    I/O-bound functions can be called concurrently in a thread pool, with an optional rate limit (calls per second or a RateLimiter).
+    Results can be checkpointed to a RowCache (or a path for one), so that reruns only calculate new or changed rows."""
+    if checkpoint is not None:
+        cache = checkpoint if isinstance(checkpoint, RowCache) else RowCache(checkpoint)
+        kwargs = {k: cache.wrap(k, fn) if callable(fn) else fn for k, fn in kwargs.items()}
+        try:
+            return _assign_rows(df, progressbar, assign_if, workers, executor, concurrency, rate_limit, **kwargs)
+        finally:
+            if cache is not checkpoint:
+                logger.info(f"Checkpoint {cache.path}: {cache.hits} hits, {cache.misses} misses, {cache.changes} changes")
+    if workers is not None or executor is not None:
+        return _assign_rows_parallel(df, progressbar, assign_if, workers, executor, kwargs)
+    kwargs = {k: _profiled("assign_rows", k, fn) for k, fn in kwargs.items()}
+    filter_fn = counted_filter_fn = _make_filter(_profiled("assign_rows", "assign_if", assign_if))
+    t = tqdm.tqdm(total=len(df) * len(kwargs)) if progressbar and tqdm else None
+    if t is not None:
+        counted_filter_fn = partial(_tqdm_wrapper, t, filter_fn)
     results = df.assign(
         **{
-            k: (lambda df, k=k, fn=fn: [(ignoring_extra_args(fn)(r, i) if callable(fn) else fn) if filter_fn(r, i) else r.get(k) for i, r in df.iterrows()])
+            k: (
+                partial(_assign_column_concurrently, k=k, fn=fn, filter_fn=filter_fn, concurrency=concurrency, rate_limit=rate_limit, t=t)
+                if concurrency is not None and callable(fn)
+                else partial(_assign_column, k=k, fn=fn, filter_fn=counted_filter_fn)
+            )
             for k, fn in kwargs.items()
         }
     )
-    if progressbar and tqdm:
+    if t is not None:
         t.close()
     return results
 
 
-def _update_columns(df, progressbar=False, update_if=None, **kwargs):
-    """Update columns using a value function, with an optional value predicate condition, or True to update just non-nans. Progress bars require tqdm."""
-    filter_fn = lambda v: (update_if is None or callable(update_if) and update_if(v) or isinstance(update_if, bool) and update_if != non(v))
-    if progressbar and tqdm:
-        t = tqdm.tqdm(total=len(df) * len(kwargs))
-        filter_fn = partial(_tqdm_wrapper, t, filter_fn)
+def _assign_rows_chunk(df, assign_if, kwargs):
+    """Calculate assign_rows values for a DataFrame chunk, returning them as lists."""
+    filter_fn = _make_filter(assign_if)
+    values = {}
+    for k, fn in kwargs.items():
+        values[k] = _assign_column(df, k, fn, filter_fn)
+        df = df.assign(**{k: values[k]})
+    return values
+
+
+def _assign_rows_parallel(df, progressbar, assign_if, workers, executor, kwargs):
+    """Run assign_rows over DataFrame chunks using an Executor (by default a process pool, or a thread pool if the
+    functions can't be pickled), reassembling the results in row order."""
+    workers = workers or os.cpu_count()
+    if len(df) == 0:
+        return _assign_rows(df, assign_if=assign_if, **kwargs)
+    pool = _choose_pool((assign_if, kwargs), executor, "row functions", logger)
+    chunks = [df.iloc[p] for p in np.array_split(np.arange(len(df)), min(len(df), workers * 4))]
+    t = tqdm.tqdm(total=len(df) * len(kwargs)) if progressbar and tqdm else None
+    with nullcontext(executor) if executor is not None else pool(workers) as ex:
+        futures = {ex.submit(_assign_rows_chunk, chunk, assign_if, kwargs): n for n, chunk in enumerate(chunks)}
+        results = [None] * len(chunks)
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if t is not None:
+                t.update(len(chunks[futures[future]]) * len(kwargs))
+    if t is not None:
+        t.close()
+    return df.assign(**{k: [v for values in results for v in values[k]] for k in kwargs})
+
+
+def _update_column_concurrently(df, k, fn, filter_fn, concurrency, rate_limit, t):
+    values = [r[k] for _, r in df.iterrows()]
+    selected = [bool(filter_fn(v)) for v in values]
+    if t is not None:
+        t.update(selected.count(False))
+    results = iter(_map_concurrently(fn, [(v,) for v, s in zip(values, selected) if s], concurrency, rate_limit, t))
+    return [next(results) if s else v for v, s in zip(values, selected)]
+
+
+def _update_columns(df, progressbar=False, update_if=None, concurrency=None, rate_limit=None, **kwargs):
+    """Update columns using a value function, with an optional value predicate condition, or True to update just non-nans. Progress bars require tqdm.
+    I/O-bound functions can be called concurrently in a thread pool, with an optional rate limit (calls per second or a RateLimiter)."""
+    kwargs = {k: _profiled("update_columns", k, fn, row=lambda args: args[0]) for k, fn in kwargs.items()}
+    update_if = _profiled("update_columns", "update_if", update_if, row=lambda args: args[0])
+    filter_fn = counted_filter_fn = lambda v: (update_if is None or callable(update_if) and update_if(v) or isinstance(update_if, bool) and update_if != non(v))
+    t = tqdm.tqdm(total=len(df) * len(kwargs)) if progressbar and tqdm else None
+    if t is not None:
+        counted_filter_fn = partial(_tqdm_wrapper, t, filter_fn)
     results = df.assign(
         **{
-            k: (lambda df, k=k, fn=fn: [(fn(r[k]) if callable(fn) else fn) if filter_fn(r[k]) else r.get(k) for _, r in df.iterrows()])
+            k: (
+                partial(_update_column_concurrently, k=k, fn=fn, filter_fn=filter_fn, concurrency=concurrency, rate_limit=rate_limit, t=t)
+                if concurrency is not None and callable(fn)
+                else (lambda df, k=k, fn=fn: [(fn(r[k]) if callable(fn) else fn) if counted_filter_fn(r[k]) else r.get(k) for _, r in df.iterrows()])
+            )
             for k, fn in kwargs.items()
         }
     )
-    if progressbar and tqdm:
+    if t is not None:
         t.close()
     return results
 
 
 def _groupby_rows(df, by):
-    """Group rows using a row/index function, index map, index list or column name."""
-    return df.groupby(lambda i: ignoring_extra_args(by)(df.ix[i], i) if callable(by) else by[i] if non_string_iterable(by) else df.ix[i].get(by))
+    """Group rows using a row/index function, index map, index list or column name. Row functions are called once per
+    row; maps, lists and column names are looked up directly."""
+    if callable(by):
+        fn = ignoring_extra_args(by)
+        keys = [fn(r, i) for i, r in df.iterrows()]
+    elif isinstance(by, pd.Series):
+        keys = by.loc[df.index].values
+    elif non_string_iterable(by):
+        keys = [by[i] for i in df.index]
+    elif by in df.columns:
+        keys = df[by].values
+    else:
+        keys = [None] * len(df)
+    return df.groupby(pd.Series(keys, index=df.index, dtype=None if len(df) else object))
 
 
-def _split_columns(df, columns, delimiter, converter=identity):
-    """Split column string values into tuples with the given delimiter."""
-    return df.update_columns(
-        **{column: ignoring_exceptions(lambda s: tuple(converter(x) for x in s.split(delimiter)), (), (AttributeError)) for column in make_iterable(columns)}
-    )
+def _splitter(delimiter, converter=identity):
+    return ignoring_exceptions(lambda s: tuple(converter(x) for x in s.split(delimiter)), (), (AttributeError))
 
 
-def _explode_to_columns(df, column, append=True):
-    """Transform each element of list-likes into a new column, with NaNs for unfilled columns."""
-    max_length = df[column].apply(ignoring_exceptions(len, 0)).max()
-    new_cols = {f"{column}_{i}": df[column].apply(ignoring_exceptions(lambda v, j=i: v[j], np.nan)) for i in range(max_length)}
-    df = df.assign(**new_cols)
+def _split_column(s, delimiter, converter=identity):
+    """Split the string values in a Series into tuples, with () for non-strings."""
+    try:
+        split = _object_column(s).str.split(delimiter, regex=False)
+    except (TypeError, AttributeError):
+        return [_splitter(delimiter, converter)(v) for v in s]
+    convert = tuple if converter is identity else ignoring_exceptions(lambda parts: tuple(converter(x) for x in parts), (), (AttributeError))
+    return [convert(parts) if isinstance(parts, list) else () for parts in split]
+
+
+def _split_columns(df, columns, delimiter, converter=identity, compact=False):
+    """Split column string values into tuples with the given delimiter, optionally compacting the results."""
+    df = df.assign(**{column: _split_column(df[column], delimiter, converter) for column in make_iterable(columns)})
+    return _compact(df, columns) if compact else df
+
+
+def _explode_to_columns(df, column, append=True, compact=False):
+    """Transform each element of list-likes into a new column, with NaNs for unfilled columns, optionally compacting
+    the new columns."""
+    values = df[column]
+    if all(isinstance(v, (tuple, list)) or not isinstance(v, abc.Sized) for v in values):
+        values = [v if isinstance(v, (tuple, list)) else () for v in values]
+        max_length = max(map(len, values), default=0)
+        padded = pd.DataFrame([tuple(v) + (np.nan,) * (max_length - len(v)) for v in values], index=df.index, columns=range(max_length))
+        new_cols = {f"{column}_{i}": padded[i] for i in range(max_length)}
+    else:
+        max_length = values.apply(ignoring_exceptions(len, 0)).max()
+        new_cols = {f"{column}_{i}": values.apply(ignoring_exceptions(lambda v, j=i: v[j], np.nan)) for i in range(max_length)}
+    df = _compact(df.assign(**new_cols), list(new_cols)) if compact else df.assign(**new_cols)
     return df if append else df[list(new_cols)]
 
 
 def _combine_columns(df, columns):
     """Combine columns into a tuple, ignoring NaNs and Nones, returning a series."""
-    return df[columns].apply(lambda s: tuple(x for x in s if nnn(x)), axis=1)
+    dtype = _iterrows_dtype(df[columns])
+    values = [df[c] if dtype is None else df[c].astype(dtype) for c in columns]
+    return pd.Series([tuple(x for x in row if nnn(x)) for row in zip(*values)], index=df.index, dtype=object)
+
+
+_ARROW_LISTS = bool(pyarrow) and int(pd.__version__.split(".")[0]) >= 2
+
+
+def _compact_column(s, max_categories, arrow):
+    """A more memory-efficient equivalent of a column, or None."""
+    if s.dtype == object and len(s):
+        kind = pd.api.types.infer_dtype(s, skipna=True)
+        if kind == "string" and s.nunique() <= max_categories * len(s):
+            return s.astype("category")
+        elif arrow and _ARROW_LISTS and kind == "mixed" and all(isinstance(v, tuple) or non(v) for v in s):
+            try:
+                values = pyarrow.array([list(v) if isinstance(v, tuple) else None for v in s])
+            except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+                return None
+            return pd.Series(values, index=s.index, name=s.name, dtype=pd.ArrowDtype(values.type))
+    elif s.dtype.kind == "i":
+        downcast = pd.to_numeric(s, downcast="integer")
+        return downcast if downcast.dtype != s.dtype else None
+    elif s.dtype == np.float64:
+        downcast = s.astype(np.float32)
+        return downcast if ((downcast == s) | s.isna()).all() else None
+    return None
+
+
+def _compact(df, columns=None, max_categories=0.5, arrow=True):
+    """Reduce the memory used by a DataFrame's columns: string columns with at most max_categories unique values per
+    row are converted to categories, integer columns are downcast and float columns are stored as float32 where that's
+    lossless. If arrow is set, tuple columns are stored as Arrow lists (this requires pandas 2 and pyarrow, and their
+    values are then returned as lists). The bytes saved are logged."""
+    duplicated = set(df.columns[df.columns.duplicated()])
+    columns = [c for c in (df.columns if columns is None else make_iterable(columns)) if c not in duplicated]
+    compacted = {c: _compact_column(df[c], max_categories, arrow) for c in columns}
+    compacted = {c: s for c, s in compacted.items() if s is not None}
+    before = df[list(compacted)].memory_usage(index=False, deep=True).sum()
+    df = df.copy(deep=False)
+    for c, s in compacted.items():
+        df[c] = s
+    saved = before - df[list(compacted)].memory_usage(index=False, deep=True).sum()
+    logger.info(f"Compacted {len(compacted)} of {len(columns)} columns, saving {saved} bytes")
+    return df
 
 
 pd.DataFrame.filter_rows = _filter_rows
@@ -99,15 +584,252 @@ pd.DataFrame.groupby_rows = _groupby_rows
 pd.DataFrame.split_columns = _split_columns
 pd.DataFrame.explode_to_columns = _explode_to_columns
 pd.DataFrame.combine_columns = _combine_columns
+pd.DataFrame.compact = _compact
+
+
+_GROUPBY_REDUCERS = {
+    np.sum: "sum",
+    np.nansum: "sum",
+    np.prod: "prod",
+    np.nanprod: "prod",
+    np.mean: "mean",
+    np.nanmean: "mean",
+    np.min: "min",
+    np.nanmin: "min",
+    np.max: "max",
+    np.nanmax: "max",
+    np.nanmedian: "median",
+    pd.Series.sum: "sum",
+    pd.Series.prod: "prod",
+    pd.Series.mean: "mean",
+    pd.Series.median: "median",
+    pd.Series.min: "min",
+    pd.Series.max: "max",
+    pd.Series.count: "count",
+    pd.Series.nunique: "nunique",
+}
 
 
-def _reduce(groupby, fn):
-    """Reduce a groupby by applying a function to every column."""
-    return groupby.apply(lambda df: df.apply(fn))
+def _reduce_groups(frames, fn):
+    return [frame.apply(fn) for frame in frames]
+
+
+def _reduce(groupby, fn, workers=None, executor=None):
+    """Reduce a groupby by applying a function to every non-grouping column. Standard numpy and pandas reducers (or their
+    names) are dispatched to the native groupby aggregation. Other functions can be applied in parallel by specifying a
+    number of workers or an Executor (by default a process pool, or a thread pool if the function can't be pickled)."""
+    agg = fn if isinstance(fn, str) else _GROUPBY_REDUCERS.get(fn) if isinstance(fn, abc.Hashable) else None
+    if agg is not None:
+        return groupby.agg(agg)
+    groups = list(groupby)
+    keys = [k for k, _ in groups]
+    frames = [frame.drop(columns=[c for c in getattr(groupby, "exclusions", ()) if c in frame.columns]) for _, frame in groups]
+    names = groupby.size().index.names
+    index = pd.MultiIndex.from_tuples(keys, names=names) if len(names) > 1 else pd.Index(keys, name=names[0], tupleize_cols=False)
+    if not frames:
+        return pd.DataFrame(columns=groupby.obj.columns.difference(getattr(groupby, "exclusions", ()), sort=False), index=index)
+    if workers is None and executor is None:
+        return pd.DataFrame(_reduce_groups(frames, fn), index=index)
+    workers = workers or os.cpu_count()
+    pool = _choose_pool(fn, executor, "reduce function", logger)
+    chunks = [[frames[i] for i in p] for p in np.array_split(np.arange(len(frames)), min(len(frames), workers * 4))]
+    with nullcontext(executor) if executor is not None else pool(workers) as ex:
+        results = list(ex.map(_reduce_groups, chunks, itertools.repeat(fn)))
+    return pd.DataFrame([r for rs in results for r in rs], index=index)
 
 
 pd.core.groupby.DataFrameGroupBy.reduce = _reduce
 
+# lazy pipelines
+
+
+class LazyRow(dict):
+    """Row passed to row functions in lazy pipelines: a dict with the row index as its name."""
+
+    __slots__ = ("name",)
+
+    def to_dict(self):
+        return dict(self)
+
+
+class LazyFrame:
+    """Deferred pipeline of row-wise bamboo operations. Consecutive filter_rows, assign_rows, update_columns and
+    split_columns steps are fused into a single pass over the rows when the pipeline is collected, and only the
+    columns that are used or modified are copied. Row functions are passed rows as LazyRow dicts rather than Series.
+    The source can also be an iterable of DataFrame chunks (e.g. from read_csvs with a chunksize), in which case the
+    pipeline is run one chunk at a time, and the results can be written incrementally using to_csv or to_parquet."""
+
+    def __init__(self, df, steps=()):
+        self.df = df
+        self.steps = tuple(steps)
+
+    def __repr__(self):
+        source = f"{self.df.shape[0]}x{self.df.shape[1]}" if isinstance(self.df, pd.DataFrame) else "chunks"
+        return "\n".join([f"LazyFrame({source})"] + [f"  .{step[0]}({', '.join(map(repr, step[1:]))})" for step in self.steps])
+
+    def _then(self, *step):
+        return LazyFrame(self.df, self.steps + (step,))
+
+    def filter_rows(self, filter):
+        """Filter rows using either a row/index predicate or a filter expression."""
+        return self._then("filter_rows", filter)
+
+    def assign_rows(self, assign_if=None, **kwargs):
+        """Assign or update columns using row/index functions, with an optional row/index predicate condition."""
+        return self._then("assign_rows", assign_if, kwargs)
+
+    def update_columns(self, update_if=None, **kwargs):
+        """Update columns using value functions, with an optional value predicate condition."""
+        return self._then("update_columns", update_if, kwargs)
+
+    def split_columns(self, columns, delimiter, converter=identity):
+        """Split column string values into tuples with the given delimiter."""
+        return self.update_columns(**{column: _splitter(delimiter, converter) for column in make_iterable(columns)})
+
+    def select(self, columns):
+        """Keep just the given columns, allowing unused columns to be skipped entirely."""
+        return self._then("select", list(columns))
+
+    def pipe(self, fn, *args, **kwargs):
+        """Apply an arbitrary DataFrame function, which ends the current fused pass."""
+        return self._then("pipe", partial(fn, *args, **kwargs))
+
+    def _run(self, df):
+        needed = _lazy_needed_columns(self.steps, None)
+        df = df if needed is None else df[[c for c in df.columns if c in needed]]
+        for fused, steps in itertools.groupby(self.steps, key=lambda step: step[0] != "pipe"):
+            if fused:
+                df = _lazy_fused_pass(df, list(steps))
+            else:
+                for step in steps:
+                    df = step[1](df)
+        return df
+
+    def chunks(self):
+        """Run the pipeline, returning an iterator of results for each source chunk. Note that chunk iterators can only
+        be consumed once."""
+        return map(self._run, [self.df] if isinstance(self.df, pd.DataFrame) else self.df)
+
+    def collect(self):
+        """Run the pipeline and return the resulting DataFrame."""
+        if isinstance(self.df, pd.DataFrame):
+            return self._run(self.df)
+        results = list(self.chunks())
+        return pd.concat([df for df in results if len(df)] or results[:1])
+
+    def to_csv(self, path, **kwargs):
+        """Run the pipeline, appending the results to a csv file one chunk at a time."""
+        header = kwargs.pop("header", True)
+        for n, df in enumerate(self.chunks()):
+            df.to_csv(path, mode="a" if n else "w", header=header if n == 0 else False, **kwargs)
+
+    def to_parquet(self, path, schema=None, **kwargs):
+        """Run the pipeline, writing the results to a Parquet file one chunk at a time, using the schema of the first
+        chunk unless one is specified. Requires pyarrow. The index is not written."""
+        writer = None
+        try:
+            for df in self.chunks():
+                if len(df) == 0:
+                    continue
+                table = pyarrow.Table.from_pandas(df, schema=schema, preserve_index=False)
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(path, table.schema, **kwargs)
+                    schema = table.schema
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+def _lazy(df):
+    """Start a deferred pipeline of row-wise operations, run by calling collect()."""
+    return LazyFrame(df)
+
+
+def _lazy_filter_columns(filter):
+    """The columns read by a row filter, or None if they're unknown."""
+    if filter is None:
+        return set()
+    elif callable(filter):
+        return None
+    keys = set(FilterExpression.keys(filter)) - {"_index_"}
+    return None if any(set(k) & set("*?[") for k in keys) else keys
+
+
+def _lazy_needed_columns(steps, needed):
+    """The input columns needed to run some pipeline steps, given the columns needed afterwards (None meaning all)."""
+    for step in reversed(steps):
+        if step[0] == "pipe":
+            needed = None
+        elif step[0] == "select":
+            needed = set(step[1])
+        elif step[0] == "filter_rows":
+            reads = _lazy_filter_columns(step[1])
+            needed = None if needed is None or reads is None else needed | reads
+        elif step[0] == "assign_rows":
+            reads = _lazy_filter_columns(step[1])
+            if needed is not None and reads is not None and not any(callable(fn) for fn in step[2].values()):
+                needed = needed | reads | set(step[2])
+            else:
+                needed = None
+        elif step[0] == "update_columns" and needed is not None:
+            needed = needed | set(step[2])
+    return needed
+
+
+def _lazy_fused_pass(df, steps):
+    """Run row-wise pipeline steps in a single pass over the rows of a DataFrame. Leading filter expressions are first
+    evaluated column-wise, as in filter_rows."""
+    while steps and steps[0][0] == "filter_rows" and isinstance(steps[0][1], str):
+        df, steps = _filter_rows(df, steps[0][1]), steps[1:]
+    if not steps:
+        return df
+    columns, modified = list(df.columns), set()
+    for step in steps:
+        if step[0] == "select":
+            columns = list(step[1])
+        elif step[0] in ("assign_rows", "update_columns"):
+            columns += [k for k in step[2] if k not in columns]
+            modified |= set(step[2])
+    kept, values = [], []
+    compiled = [
+        (
+            step[0],
+            _make_filter(step[1]) if step[0] in ("filter_rows", "assign_rows") else step[1],
+            {k: ignoring_extra_args(fn) if callable(fn) and step[0] == "assign_rows" else fn for k, fn in step[2].items()} if len(step) > 2 else None,
+        )
+        for step in steps
+    ]
+    rows = df.itertuples(index=False, name=None) if len(df.columns) else itertools.repeat(())
+    for n, (i, row_values) in enumerate(zip(df.index, rows)):
+        row = LazyRow(zip(df.columns, row_values))
+        row.name = i
+        for kind, condition, kwargs in compiled:
+            if kind == "filter_rows":
+                if not condition(row, i):
+                    break
+            elif kind == "assign_rows":
+                for k, fn in kwargs.items():
+                    row[k] = (fn(row, i) if callable(fn) else fn) if condition(row, i) else row.get(k)
+            elif kind == "select":
+                row, row.name = LazyRow((k, row[k]) for k in condition), i
+            elif kind == "update_columns":
+                for k, fn in kwargs.items():
+                    v = row[k]
+                    if condition is None or callable(condition) and condition(v) or isinstance(condition, bool) and condition != non(v):
+                        row[k] = fn(v) if callable(fn) else fn
+        else:
+            kept.append(n)
+            values.append([row[k] for k in columns if k in modified])
+    results = pd.DataFrame(values, columns=[k for k in columns if k in modified], index=df.index[kept])
+    for k in columns:
+        if k not in modified:
+            results[k] = df[k].iloc[kept].values
+    return results[columns]
+
+
+pd.DataFrame.lazy = _lazy
+
 # standalone functions
 
 
@@ -126,9 +848,149 @@ def prompt_for_value(default=np.nan, prompt=lambda r: r.to_dict()):
     return updater
 
 
-def read_csvs(files, *args, **kwargs):
-    """Read and concatenate multiple csv files"""
-    return pd.concat([pd.read_csv(file, *args, **kwargs) for file in glob.glob(files)], ignore_index=True)
+def read_csvs(files, *args, chunksize=None, workers=None, cache=False, **kwargs):
+    """Read and concatenate multiple csv files. Files can be parsed in parallel using a number of worker processes,
+    and cached as binary sidecar files (True to store these in a .csvcache directory next to the csv files, or a directory
+    path), which are reused as long as the csv file size, modification time and read arguments are unchanged, and
+    replaced otherwise. If a chunksize is
+    specified, returns an iterator of DataFrame chunks across all the files instead, with a continuous index
+    (e.g. for streaming through a LazyFrame)."""
+    if chunksize is not None:
+        return _read_csv_chunks(glob.glob(files), chunksize, args, kwargs)
+    files, read = glob.glob(files), partial(_read_csv, args=args, kwargs=kwargs, cache=cache)
+    if workers is None or len(files) < 2:
+        return pd.concat([read(file) for file in files], ignore_index=True)
+    pool = _choose_pool((args, kwargs), None, "read_csv arguments", logger)
+    with pool(workers) as executor:
+        return pd.concat(list(executor.map(read, files)), ignore_index=True)
+
+
+def _read_csv(file, args, kwargs, cache=False):
+    """Read a csv file, optionally via a pickled sidecar cache keyed on the file's size and modification time and the read_csv arguments."""
+    if not cache:
+        return pd.read_csv(file, *args, **kwargs)
+    stat, path = os.stat(file), os.path.abspath(file)
+    key = repr((stat.st_mtime_ns, stat.st_size, args, sorted(kwargs.items())))
+    directory = os.path.join(os.path.dirname(path), ".csvcache") if cache is True else cache
+    sidecar = os.path.join(directory, f"{os.path.basename(file)}.{hashlib.sha1(path.encode()).hexdigest()[:16]}.pkl")
+    if os.path.exists(sidecar):
+        try:
+            with open(sidecar, "rb") as f:
+                cached_key, df = pickle.load(f)
+            if cached_key == key:
+                return df
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable csv cache {sidecar}: {e}")
+    df = pd.read_csv(file, *args, **kwargs)
+    os.makedirs(directory, exist_ok=True)
+    with open(f"{sidecar}.{os.getpid()}.tmp", "wb") as f:
+        pickle.dump((key, df), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{sidecar}.{os.getpid()}.tmp", sidecar)
+    return df
+
+
+def _read_csv_chunks(files, chunksize, args, kwargs):
+    offset = 0
+    for file in files:
+        with pd.read_csv(file, *args, chunksize=chunksize, **kwargs) as reader:
+            for chunk in reader:
+                chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+                offset += len(chunk)
+                yield chunk
+
+
+def filter_records(records, filter=None, columns=None, start=0):
+    """Lazily filter a stream of dict records using a record/index predicate or filter expression, optionally projecting
+    the matching records onto the given keys. Indices are record positions in the stream, offset by start."""
+    filter_fn = _make_filter(filter)
+    for i, d in enumerate(records, start):
+        if filter_fn(d, i):
+            yield d if columns is None else {k: d[k] for k in columns if k in d}
+
+
+def _open_text(file, mode="r"):
+    return gzip.open(file, mode + "t", encoding="utf-8") if file.endswith(".gz") else open(file, mode, encoding="utf-8")
+
+
+def _jsonl_batches(files, batch_size):
+    """Batches of JSON record lines and their starting record positions. Also accepts one-record-per-line JSON arrays
+    (such as Wikidata dumps)."""
+    start, batch = 0, []
+    for file in files:
+        with _open_text(file) as f:
+            for line in f:
+                line = line.strip().rstrip(",")
+                if line and line not in ("[", "]"):
+                    batch.append(line)
+                    if len(batch) == batch_size:
+                        yield start, batch
+                        start, batch = start + len(batch), []
+    if batch:
+        yield start, batch
+
+
+def _filter_jsonl_batch(start, lines, filter, columns):
+    return len(lines), list(filter_records(map(json.loads, lines), filter, columns, start))
+
+
+def read_jsonl(files, filter=None, columns=None, workers=None, batch_size=10000, progressbar=False):
+    """Lazily read records from JSON Lines files (optionally gzipped), yielding those that match an optional record/index
+    predicate or filter expression, projected onto the given keys. Records can be decoded and filtered in parallel batches
+    using a number of worker processes (or threads, if the filter can't be pickled). Throughput is logged on completion."""
+    files, started = glob.glob(files), time.perf_counter()
+    batches = _jsonl_batches(files, batch_size)
+    t = tqdm.tqdm(unit=" records") if progressbar and tqdm else None
+    read = matched = 0
+    if workers is None:
+        results = (_filter_jsonl_batch(start, lines, filter, columns) for start, lines in batches)
+        pool = None
+    else:
+        pool = _choose_pool((filter, columns), None, "the record filter", logger)(workers)
+        results = _map_bounded(pool, _filter_jsonl_batch, batches, filter, columns, window=workers * 2)
+    try:
+        for n, records in results:
+            read, matched = read + n, matched + len(records)
+            if t is not None:
+                t.update(n)
+            yield from records
+    finally:
+        results.close()
+        if pool is not None:
+            pool.shutdown()
+        if t is not None:
+            t.close()
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    size = sum(os.path.getsize(file) for file in files)
+    logger.info(
+        f"Read {read} records ({matched} matching) from {len(files)} files in {elapsed:.1f}s: "
+        f"{read / elapsed:.0f} records/s, {size / elapsed / 2**20:.1f} MB/s"
+    )
+
+
+def _map_bounded(pool, fn, batches, *args, window):
+    """Map a function over (start, batch) pairs in an executor, yielding results in order while keeping at most
+    window batches in flight."""
+    futures = deque()
+    try:
+        for start, batch in batches:
+            futures.append(pool.submit(fn, start, batch, *args))
+            if len(futures) >= window:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def write_jsonl(records, path):
+    """Write dict records to a JSON Lines file (gzipped if the path ends in .gz), returning the number written."""
+    n = 0
+    with _open_text(path, "w") as f:
+        for n, record in enumerate(records, 1):
+            f.write(json.dumps(record, ensure_ascii=False, default=str))
+            f.write("\n")
+    return n
 
 
 def pd_print(item, **kwargs):
@@ -147,6 +1009,151 @@ pr = print_rows
 
 # filter expressions
 
+
+def _filter_operator(fn, vectorized, compile=identity, symbol=None):
+    """Filter operator that returns False on exceptions, with a vectorized equivalent for columns, a compiler for
+    values (e.g. regular expressions) that is applied at parse time and a symbol used for FilterIndex lookups."""
+
+    def op(x, y):
+        try:
+            return fn(x, y)
+        except Exception:
+            if _profiler is not None:
+                _profiler.swallowed()
+            return False
+
+    op.vectorized = vectorized
+    op.compile = compile
+    op.symbol = symbol
+    return op
+
+
+@functools.lru_cache(maxsize=1024)
+def _matching_keys(pattern, keys):
+    """Positions of the keys matching a wildcard pattern, cached per pattern and key set."""
+    return [j for j, k in enumerate(keys) if fnmatch.fnmatch(k, pattern)]
+
+
+def _numeric_column(s):
+    return s if isinstance(s.dtype, np.dtype) and s.dtype.kind in "biufc" else raise_exception(TypeError("Expected a numeric column"))
+
+
+def _object_column(s):
+    return s if s.dtype == object else raise_exception(TypeError("Expected an object column"))
+
+
+def _regex_column(s, pattern):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)  # match groups are irrelevant here
+        return s.map(str).str.contains(pattern, regex=True)
+
+
+_filter_indexes = {}
+
+
+class FilterIndex:
+    """Indexes of DataFrame columns for repeated filter expression queries, used automatically by filter expression
+    masks (and hence filter_rows) on the indexed DataFrame. Numeric columns are stored as sorted arrays, for range and
+    equality comparisons by binary search; other columns as hash maps from values (and sequence elements) to rows, for
+    =, != and >> lookups. Columns that are replaced are ignored, but the index must be rebuilt after in-place edits."""
+
+    def __init__(self, df, columns=None):
+        self.frame = weakref.ref(df)
+        self.rows = len(df)
+        self.sorted, self.hashed, self.contents, self.arrays = {}, {}, {}, {}
+        unique = df.columns[~df.columns.duplicated(keep=False)]
+        for column in unique if columns is None else [c for c in make_iterable(columns) if c in unique]:
+            values = df[column].values
+            if isinstance(values, np.ndarray) and values.dtype.kind in "biuf":
+                valid = np.flatnonzero(~np.isnan(values)) if values.dtype.kind == "f" else np.arange(len(values))
+                order = valid[np.argsort(values[valid], kind="stable")]
+                self.sorted[column] = (values[order], order)
+            elif isinstance(values, pd.Categorical):
+                self.hashed[column] = self._positions(values.codes, values.categories)
+            elif values.dtype == object:
+                try:
+                    self.hashed[column] = self._positions(*pd.factorize(values))
+                except TypeError:
+                    pass
+                self._index_contents(column, values)
+            self.arrays[column] = self._array(df, column)
+        if id(df) not in _filter_indexes:
+            weakref.finalize(df, _filter_indexes.pop, id(df), None)
+        _filter_indexes[id(df)] = self
+
+    def __repr__(self):
+        return f"FilterIndex({self.rows} rows, sorted={list(self.sorted)}, hashed={list(self.hashed)}, contents={list(self.contents)})"
+
+    @staticmethod
+    def _array(df, column):
+        values = df[column].values
+        values = values.codes if isinstance(values, pd.Categorical) else values
+        return values if isinstance(values, np.ndarray) else None
+
+    def _unchanged(self, df, column):
+        """Whether a column still holds the indexed array. The index keeps the indexed arrays alive, so a replacement
+        column can't reuse their memory."""
+        old, new = self.arrays.get(column), self._array(df, column)
+        if old is None or new is None:
+            return False
+        return old.__array_interface__["data"] == new.__array_interface__["data"] and old.shape == new.shape and old.strides == new.strides
+
+    @staticmethod
+    def _positions(codes, keys):
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(keys) + 1))
+        return {k: order[bounds[n] : bounds[n + 1]] for n, k in enumerate(keys)}
+
+    def _index_contents(self, column, values):
+        """Index elements of columns whose values are all non-string sequences or missing."""
+        rows, elements = [], []
+        try:
+            for n, v in enumerate(values):
+                if isinstance(v, (tuple, list, set, frozenset)):
+                    distinct = set(v)
+                    rows.extend([n] * len(distinct))
+                    elements.extend(distinct)
+                elif not non(v):
+                    return
+            codes, keys = pd.factorize(pd.Series(elements, dtype=object))
+        except TypeError:
+            return
+        sequences = np.array([isinstance(v, (tuple, list, set, frozenset)) for v in values], dtype=bool)
+        self.contents[column] = ({k: np.asarray(rows)[p] for k, p in self._positions(codes, keys).items()}, sequences)
+
+    @classmethod
+    def lookup(cls, df):
+        """The FilterIndex built on a DataFrame, if there is one."""
+        index = _filter_indexes.get(id(df))
+        return index if index is not None and index.frame() is df and index.rows == len(df) else None
+
+    def remove(self):
+        """Stop the index from being used."""
+        if _filter_indexes.get(id(self.frame())) is self:
+            del _filter_indexes[id(self.frame())]
+
+    def mask(self, df, column, symbol, value):
+        """Boolean array of rows matching a field expression, or None if it can't be answered by the index."""
+        if not self._unchanged(df, column):
+            return None
+        numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+        mask = np.zeros(self.rows, dtype=bool)
+        if column in self.sorted and numeric and symbol in ("<", "<=", "=", "!=", ">", ">="):
+            values, order = self.sorted[column]
+            left, right = np.searchsorted(values, value, "left"), np.searchsorted(values, value, "right")
+            slices = {"<": order[:left], "<=": order[:right], "=": order[left:right], "!=": order[left:right], ">": order[right:], ">=": order[left:]}
+            mask[slices[symbol]] = True
+            return ~mask if symbol == "!=" else mask
+        elif column in self.hashed and symbol in ("=", "!="):
+            mask[self.hashed[column].get(value, [])] = True
+            return ~mask if symbol == "!=" else mask
+        elif column in self.contents and symbol in (">>", "!>>"):
+            elements, sequences = self.contents[column]
+            mask[elements.get(value, [])] = True
+            return mask if symbol == ">>" else sequences & ~mask
+        return None
+
+
 if pyparsing:
     from pyparsing import CaselessLiteral, Combine, Literal, Optional, QuotedString, Word, alphas, alphas8bit, infixNotation, nums, oneOf, opAssoc
 
@@ -174,6 +1181,13 @@ if pyparsing:
 
         onlen = lambda f: (lambda x, y: f(len(x), y))
 
+        # vectorized operator equivalents, acting on whole columns (and raising to fall back to per-value evaluation)
+        on_numeric = lambda f: (lambda s, y: f(_numeric_column(s), y))
+        on_object = lambda f: (lambda s, y: f(_object_column(s), y))
+        on_lengths = lambda f: (lambda s, y: (lambda l: l.notna() & f(l, y))(_object_column(s).str.len()))
+        on_regex = lambda f: (lambda s, y: f(_regex_column(s, y)))
+        on_contents = lambda b: (lambda s, y: _object_column(s).str.contains(y, regex=False).eq(b))
+
         num_ops = {
             "<": operator.lt,
             "<=": operator.le,
@@ -188,28 +1202,66 @@ if pyparsing:
             "#>": onlen(operator.gt),
             "#>=": onlen(operator.ge),
         }
+        vec_num_ops = {
+            "<": on_numeric(operator.lt),
+            "<=": on_numeric(operator.le),
+            "=": on_numeric(operator.eq),
+            "!=": on_numeric(operator.ne),
+            ">": on_numeric(operator.gt),
+            ">=": on_numeric(operator.ge),
+            "#<": on_lengths(operator.lt),
+            "#<=": on_lengths(operator.le),
+            "#=": on_lengths(operator.eq),
+            "#!=": on_lengths(operator.ne),
+            "#>": on_lengths(operator.gt),
+            "#>=": on_lengths(operator.ge),
+        }
         str_ops = {
             "=": lambda x, y: x == str(y),
             "!=": lambda x, y: x != str(y),
-            "~": lambda x, y: re.search(y, str(x)),
-            "!~": lambda x, y: not re.search(y, str(x)),
+            "~": lambda x, y: y.search(str(x)),
+            "!~": lambda x, y: not y.search(str(x)),
             ">>": lambda x, y: y in x,
             "!>>": lambda x, y: y not in x,
         }
+        vec_str_ops = {
+            "=": on_object(operator.eq),
+            "!=": on_object(operator.ne),
+            "~": on_regex(lambda m: m),
+            "!~": on_regex(lambda m: ~m),
+            ">>": on_contents(True),
+            "!>>": on_contents(False),
+        }
         exist_ops = {":": lambda x, y: {"exists": not non(x), "true": bool(x)}[y.lower()]}
+        vec_exist_ops = {
+            ":": lambda s, y: {
+                "exists": lambda: (
+                    s.notna()
+                    if s.dtype == np.float64 or pd.api.types.is_extension_array_dtype(s.dtype)
+                    else pd.Series(True, index=s.index) if s.dtype.kind in "biu" else raise_exception(TypeError())
+                ),
+                "true": lambda: _numeric_column(s).astype(bool),
+            }[y.lower()]()
+        }
+
+        str_compilers = {"~": re.compile, "!~": re.compile}
 
-        oneOfOpMap = lambda map: oneOf(list(map.keys())).setParseAction(lambda t: ignoring_exceptions(map[t[0]], False))
+        oneOfOpMap = lambda map, vmap, cmap={}: oneOf(list(map.keys())).setParseAction(
+            lambda t: _filter_operator(map[t[0]], vmap[t[0]], cmap.get(t[0], identity), t[0])
+        )
 
-        num_op = oneOfOpMap(num_ops)
-        str_op = oneOfOpMap(str_ops)
-        exist_op = oneOfOpMap(exist_ops)
+        num_op = oneOfOpMap(num_ops, vec_num_ops)
+        str_op = oneOfOpMap(str_ops, vec_str_ops, str_compilers)
+        exist_op = oneOfOpMap(exist_ops, vec_exist_ops)
 
         quoted_string = QuotedString('"', "\\") | QuotedString("'", "\\")
         key_value = Word(alphas + alphas8bit + "*?[]_") | quoted_string
         str_value = Word(alphas + alphas8bit + "_") | quoted_string
         exist_value = CaselessLiteral("True") | CaselessLiteral("Exists")
 
-        base_expr = (key_value + (str_op + str_value | num_op + number | exist_op + exist_value)).setParseAction(lambda t: [t])
+        base_expr = (key_value + (str_op + str_value | num_op + number | exist_op + exist_value)).setParseAction(
+            lambda t: [[t[0], t[1], ignoring_exceptions(t[1].compile, t[2])(t[2])]]
+        )
         expr = infixNotation(
             base_expr,
             [
@@ -227,17 +1279,84 @@ if pyparsing:
                 return cls._eval_parse(parse[0], d, i)
             elif callable(parse[0]):
                 return parse[0](cls._eval_parse(parse[1], d, i))
+            elif isinstance(parse[0], str):
+                x, op, y = parse
+                if x == "_index_":
+                    return op(i, y)
+                else:
+                    keys = tuple(d.keys())
+                    return any(op(d[keys[j]], y) for j in _matching_keys(x, keys))
             else:
-                x, y = cls._eval_parse(parse[0], d, i), cls._eval_parse(parse[2], d, i)
+                return functools.reduce(lambda x, opy: opy[0](x, cls._eval_parse(opy[1], d, i)), zip(parse[1::2], parse[2::2]), cls._eval_parse(parse[0], d, i))
+
+        @classmethod
+        def _eval_series(cls, op, s, y):
+            if isinstance(s.dtype, pd.CategoricalDtype):
+                categories = pd.Series([*s.cat.categories, np.nan], dtype=object)
+                return pd.Series(cls._eval_series(op, categories, y).values[s.cat.codes.values], index=s.index)
+            try:
+                result = op.vectorized(s, y)
+            except Exception:
+                result = s.astype(object).map(lambda x: op(x, y))
+            return result.fillna(False).astype(bool)
+
+        @classmethod
+        def _eval_column(cls, op, df, j, y, dtype, index):
+            mask = None if index is None else index.mask(df, df.columns[j], op.symbol, y)
+            if mask is not None:
+                return pd.Series(mask, index=df.index)
+            c = df.iloc[:, j]
+            return cls._eval_series(op, c if dtype is None else c.astype(dtype, copy=False), y)
+
+        @classmethod
+        def _eval_mask(cls, parse, df, dtype, index=None):
+            if len(parse) == 1:
+                return cls._eval_mask(parse[0], df, dtype, index)
+            elif callable(parse[0]):
+                return ~cls._eval_mask(parse[1], df, dtype, index)
+            elif isinstance(parse[0], str):
+                x, op, y = parse
                 if x == "_index_":
-                    return parse[1](i, y)
-                elif isinstance(x, str):
-                    return any(parse[1](d[k], y) for k in d.keys() if fnmatch.fnmatch(k, x))
+                    return cls._eval_series(op, df.index.to_series(index=df.index), y)
                 else:
-                    return parse[1](x, y)
+                    masks = (cls._eval_column(op, df, j, y, dtype, index) for j in _matching_keys(x, tuple(df.columns)))
+                    return functools.reduce(operator.or_, masks, pd.Series(False, index=df.index))
+            else:
+                return functools.reduce(
+                    lambda x, opy: opy[0](x, cls._eval_mask(opy[1], df, dtype, index)),
+                    zip(parse[1::2], parse[2::2]),
+                    cls._eval_mask(parse[0], df, dtype, index),
+                )
+
+        @classmethod
+        @functools.lru_cache(maxsize=256)
+        def _parse(cls, string):
+            return cls.expr.parseString(string, parseAll=True).asList()
+
+        @classmethod
+        def keys(cls, string):
+            """Returns the key names (including any wildcards) used in a filter expression."""
+
+            def keys(parse):
+                if isinstance(parse, list) and len(parse) == 3 and isinstance(parse[0], str):
+                    yield parse[0]
+                elif isinstance(parse, list):
+                    for p in parse:
+                        yield from keys(p)
+
+            return list(remove_duplicates(keys(cls._parse(string))))
 
         @classmethod
         def make_filter(cls, string):
-            """Generates a filter function from a filter expression."""
-            parse = cls.expr.parseString(string, parseAll=True).asList()
-            return lambda d, i=None: cls._eval_parse(parse, d, i)
+            """Generates a filter function from a filter expression. Parses are cached, and regular expressions are precompiled."""
+            parse = cls._parse(string)
+            return _profiled("FilterExpression", string, lambda d, i=None: cls._eval_parse(parse, d, i))
+
+        @classmethod
+        def make_mask(cls, string):
+            """Generates a DataFrame mask function from a filter expression. Each field expression is evaluated
+            once per matching column, using vectorized pandas operations where possible, with the same results as
+            applying make_filter to each row. Columns indexed by a FilterIndex are looked up in the index instead."""
+            parse = cls._parse(string)
+            mask = lambda df: cls._eval_mask(parse, df, _iterrows_dtype(df), FilterIndex.lookup(df))
+            return _profiled("FilterExpression", string, mask, row=lambda args: None)
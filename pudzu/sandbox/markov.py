@@ -1,14 +1,29 @@
 import argparse
 import bisect
 import functools
+import heapq
+import io
 import itertools
+import json
+import logging
 import operator as op
+import os
 import pickle
 import random
 import string
 import sys
 import unicodedata
-from collections import Counter
+from collections import Counter, abc, deque
+
+from pudzu.utils import identity, optional_import
+
+from pudzu.sandbox._parallel import _choose_pool
+
+np = optional_import("numpy")
+pd = optional_import("pandas")
+sparse = optional_import("scipy.sparse")
+
+logger = logging.getLogger("markov")
 
 # Simple Markov n-gram based generator.
 
@@ -18,15 +33,51 @@ def generate_ngrams(iterable, n):
     return zip(*[itertools.islice(it, i, None) for i, it in enumerate(itertools.tee(iterable, n))])
 
 
+class CumulativeTable(object):
+    """Precomputed cumulative weights for repeatedly sampling keys in O(log k)."""
+
+    def __init__(self, keys, cumulative):
+        if len(keys) == 0:
+            raise Exception("No matching elements in Counter collection")
+        self.keys = keys
+        self.cumulative = cumulative
+
+    @classmethod
+    def from_counter(cls, counter, filter=None):
+        """Table for sampling the elements of a Counter collection (or those matching a filter), weighted by count."""
+        if filter is not None:
+            counter = {k: v for k, v in counter.items() if filter(k)}
+        return cls(list(counter.keys()), list(itertools.accumulate(list(counter.values()), op.add)))
+
+    def sample(self):
+        """Return a single random key."""
+        return self.keys[bisect.bisect_left(self.cumulative, random.uniform(0, self.cumulative[-1]))]
+
+
 def counter_random(counter, filter=None):
-    """Return a single random elements from the Counter collection, weighted by count."""
-    if filter is not None:
-        counter = {k: v for k, v in counter.items() if filter(k)}
-    if len(counter) == 0:
-        raise Exception("No matching elements in Counter collection")
-    seq = list(counter.keys())
-    cum = list(itertools.accumulate(list(counter.values()), op.add))
-    return seq[bisect.bisect_left(cum, random.uniform(0, cum[-1]))]
+    """Return a single random elements from the Counter collection, weighted by count. To sample repeatedly from the
+    same Counter, use a CumulativeTable instead."""
+    return CumulativeTable.from_counter(counter, filter).sample()
+
+
+class StartsWith(object):
+    """Start n-gram predicate for contexts beginning with a given symbol. MarkovGenerator.render looks these up in an
+    index of contexts by leading symbol rather than testing every context."""
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+
+    def __call__(self, ngram):
+        return ngram[0] == self.symbol
+
+    def __eq__(self, other):
+        return isinstance(other, StartsWith) and other.symbol == self.symbol
+
+    def __hash__(self):
+        return hash((StartsWith, self.symbol))
+
+    def __repr__(self):
+        return f"StartsWith({self.symbol!r})"
 
 
 def latin_normalise(i, letters=string.ascii_letters + " ", lowercase=True):
@@ -37,53 +88,931 @@ def latin_normalise(i, letters=string.ascii_letters + " ", lowercase=True):
 class MarkovGenerator(object):
     """Markov Chain n-gram-based generator for arbitrary iterables."""
 
-    def __init__(self, order):
-        """Initialise generator for a given n-gram order."""
+    prune_target = 0.75
+
+    def __init__(self, order, max_contexts=None):
+        """Initialise generator for a given n-gram order, optionally with a budget on the number of contexts to
+        keep during training."""
         self.n = order
+        self.max_contexts = max_contexts
         self.markov_dict = {}
         self.prob_dict = Counter()
+        self._start_predicates = set()
+        self._reset_pruning()
+        self._clear_tables()
+
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k not in ("_tables", "_start_tables", "_leading_tables", "_start_predicates", "_compact")}
+
+    def __setstate__(self, state):
+        self.max_contexts = None
+        self._reset_pruning()
+        self.__dict__.update(state)
+        self._start_predicates = set()
+        self._clear_tables()
+
+    def _clear_tables(self):
+        """Clear the cached sampling tables."""
+        self._tables, self._start_tables, self._leading_tables, self._compact = {}, {}, None, None
+
+    def register_start(self, predicate):
+        """Register a start n-gram predicate, so that render caches a sampling table for it rather than testing every
+        context each time. Predicates that just test the first symbol can use StartsWith instead."""
+        self._start_predicates.add(predicate)
+
+    def _start_table(self, start_ngram):
+        """Sampling table of start contexts, cached unless start_ngram is an unregistered function."""
+        key = start_ngram if callable(start_ngram) else None if start_ngram is None else tuple(start_ngram)
+        table = self._start_tables.get(key)
+        if table is None:
+            table = self._make_start_table(key)
+            if not callable(key) or isinstance(key, StartsWith) or key in self._start_predicates:
+                self._start_tables[key] = table
+        return table
 
     def reset(self):
         """Reset generator."""
-        self.__init__(self.n)
+        self.__init__(self.n, self.max_contexts)
+
+    def _reset_pruning(self):
+        """Reset the lossy counting state: the pruning threshold, the minimum undercount of every context (after
+        merging pruned generators), the undercounts of contexts first seen after pruning, and pruning totals."""
+        self._threshold, self._floor, self._undercounts, self._pruned = 0, 0, {}, Counter()
+
+    def _make_start_table(self, key):
+        if isinstance(key, StartsWith):
+            if self._leading_tables is None:
+                leading = {}
+                for ngram, count in self.prob_dict.items():
+                    if ngram:
+                        leading.setdefault(ngram[0], Counter())[ngram] = count
+                self._leading_tables = {symbol: CumulativeTable.from_counter(counter) for symbol, counter in leading.items()}
+            return self._leading_tables.get(key.symbol) or CumulativeTable([], [])
+        return CumulativeTable.from_counter(self.prob_dict, filter=key if callable(key) or key is None else lambda n: n == key)
+
+    def _successor_table(self, ngram):
+        """Cached sampling table of successors to a context."""
+        table = self._tables.get(ngram)
+        if table is None:
+            table = self._tables[ngram] = CumulativeTable.from_counter(self.markov_dict[ngram])
+        return table
 
     def train(self, iterable):
-        """Train generator on an iterable."""
+        """Train generator on an iterable. If the generator has a max_contexts budget, the least frequent contexts
+        are pruned using lossy counting whenever a new context would exceed it (see approximation_error)."""
+        self._clear_tables()
         for ngram in generate_ngrams(iterable, self.n + 1):
-            self.markov_dict.setdefault(ngram[: self.n], Counter()).update([ngram[self.n]])
-            self.prob_dict.update([ngram[: self.n]])
+            context = ngram[: self.n]
+            if context not in self.markov_dict:
+                if self.max_contexts is not None and len(self.markov_dict) >= self.max_contexts:
+                    self._prune()
+                if self._threshold:
+                    self._undercounts[context] = self._threshold
+                self.markov_dict[context] = Counter()
+            self.markov_dict[context].update([ngram[self.n]])
+            self.prob_dict.update([context])
 
-    def train_file(self, filename, encoding="utf-8", convert=itertools.chain.from_iterable, normalise=lambda i: i):
+    def _train_boundary(self, tail, overlap):
+        """Train generator on just the n-grams that start in the tail symbols and end in the overlap ones."""
+        self.train(tail[-self.n :] + overlap[: self.n])
+
+    def _prune(self):
+        """Lossy counting: raise the threshold enough to bring the number of contexts down to prune_target of the
+        budget, then prune every context whose count plus maximum undercount is within it."""
+        scores = {context: count + max(self._floor, self._undercounts.get(context, 0)) for context, count in self.prob_dict.items()}
+        excess = len(scores) - int(self.max_contexts * self.prune_target)
+        if excess > 0:
+            self._threshold = max(self._threshold, heapq.nsmallest(excess, scores.values())[-1])
+        for context, score in scores.items():
+            if score <= self._threshold:
+                self._pruned["contexts"] += 1
+                self._pruned["count"] += self.prob_dict.pop(context)
+                del self.markov_dict[context]
+                self._undercounts.pop(context, None)
+        logger.info(f"Pruned contexts with counts up to {self._threshold}, leaving {len(self.markov_dict)}")
+
+    def _merge_pruning(self, other):
+        """Combine the lossy counting state of a merged generator: every context may be undercounted in both."""
+        if other._threshold:
+            self._threshold = self._floor = self._threshold + other._threshold
+        self._pruned.update(other._pruned)
+
+    def _total(self):
+        return sum(self.prob_dict.values())
+
+    def _uncertain(self):
+        return len(self.markov_dict) if self._floor else len(self._undercounts)
+
+    def approximation_error(self):
+        """Report the approximation introduced by bounded-memory training (or by merging generators that used it).
+        Returns a dict containing the pruning threshold, the number of contexts pruned (including repeatedly pruned
+        ones), the total count of the n-grams pruned and their fraction of all the training n-grams, and the number of
+        remaining contexts whose counts may be underestimated. The threshold bounds the underestimate of any
+        remaining context's count (and successor counts), and any context whose true count exceeds it is kept."""
+        total = self._total()
+        return {
+            "threshold": self._threshold,
+            "pruned_contexts": self._pruned["contexts"],
+            "pruned_count": self._pruned["count"],
+            "pruned_fraction": self._pruned["count"] / (total + self._pruned["count"]) if self._pruned["count"] else 0.0,
+            "uncertain_contexts": self._uncertain(),
+        }
+
+    def train_file(self, filename, encoding="utf-8", convert=itertools.chain.from_iterable, normalise=identity, workers=None):
         """Train generator on a file. Accepts optional convert function (defaults to reading characters) and
-        normalise function (defaults to the identity)."""
-        with open(filename, "r", encoding=encoding) as f:
-            self.train(normalise(convert(f)))
+        normalise function (defaults to the identity). If a number of workers is specified, the file is split into
+        shards at line boundaries that are counted in parallel processes (or threads, if the functions can't be
+        pickled) and then merged, giving the same result as serial training. This requires convert and normalise
+        to treat each line independently."""
+        if workers is None:
+            with open(filename, "r", encoding=encoding) as f:
+                self.train(normalise(convert(f)))
+            return
+        pool = _choose_pool((convert, normalise), None, "the convert or normalise functions", logger)
+        bounds = _shard_boundaries(filename, workers * 4)
+        self._clear_tables()
+        with pool(workers) as executor:
+            args = [(type(self), self.n, self.max_contexts, filename, encoding, convert, normalise, start, end) for start, end in zip(bounds, bounds[1:])]
+            for shard in executor.map(_train_shard, *zip(*args)):
+                self._update(shard)
+
+    def _update(self, other):
+        """Add another generator's counts to this one."""
+        for ngram, counter in other.markov_dict.items():
+            if ngram not in self.markov_dict:
+                if self._threshold:
+                    self._undercounts[ngram] = self._threshold
+                self.markov_dict[ngram] = Counter()
+            self.markov_dict[ngram].update(counter)
+        self.prob_dict.update(other.prob_dict)
+        self._merge_pruning(other)
+        if self.max_contexts is not None and len(self.markov_dict) > self.max_contexts:
+            self._prune()
+        self._clear_tables()
+
+    def merge(self, *others):
+        """Add the counts of other generators of the same order (of either form) to this one, as if it had been
+        trained on their training data too."""
+        for other in others:
+            if other.n != self.n:
+                raise ValueError(f"Can't merge an order {other.n} generator into an order {self.n} one")
+            self._update(other)
+
+    def __add__(self, other):
+        if not isinstance(other, MarkovGenerator):
+            return NotImplemented
+        result = type(self)(self.n, self.max_contexts)
+        result.merge(self, other)
+        return result
+
+    def __iadd__(self, other):
+        if not isinstance(other, MarkovGenerator):
+            return NotImplemented
+        self.merge(other)
+        return self
+
+    def save(self, path, base=None, **metadata):
+        """Save generator in the binary model format (see CompactMarkovGenerator.save)."""
+        CompactMarkovGenerator.from_generator(self).save(path, base, **metadata)
 
     def render(self, stop_when, start_ngram=None):
         """Return a tuple using the trained probabilities. Stop condition can be a maximum length or function."""
         stop_fn = stop_when if callable(stop_when) else lambda o: len(o) >= stop_when
-        start_fn = start_ngram if (callable(start_ngram) or start_ngram is None) else lambda n: n == tuple(start_ngram)
-        ngram = counter_random(self.prob_dict, filter=start_fn)
+        ngram = self._start_table(start_ngram).sample()
         output = ngram
         while True:
             if stop_fn(output):
                 break
             elif ngram in self.markov_dict:
-                v = counter_random(self.markov_dict[ngram])
+                v = self._successor_table(ngram).sample()
                 output += (v,)
                 ngram = ngram[1:] + (v,)
             else:
-                ngram = counter_random(self.prob_dict)
+                ngram = self._start_table(None).sample()
         return output
 
     def render_word(self, min_length=3, max_length=12):
         """Generates a word. Assumes training on characters including spaces.
         Doesn't filter out real words."""
         while True:
-            word = "".join(self.render(lambda o: len(o) > 1 and o[-1] == " ", lambda n: n[0] == " "))
+            word = "".join(self.render(lambda o: len(o) > 1 and o[-1] == " ", StartsWith(" ")))
             if min_length <= len(word.strip()) <= max_length:
                 return word.strip()
 
+    def render_many(self, number, stop_when=" ", min_length=3, max_length=12, seed=None, exclude=(), start_ngram=None):
+        """Generate many outputs at once, advancing the chains in lockstep using NumPy. If stop_when is a symbol, returns
+        words like render_word: chains start from contexts beginning with that symbol and stop when they generate it
+        again, and are kept if their stripped length is between min_length and max_length and they're not in exclude.
+        If stop_when is an integer, returns tuples like render. Output is reproducible for a given seed. Uses a cached
+        CompactMarkovGenerator copy of the model."""
+        return self._as_compact().render_many(number, stop_when, min_length, max_length, seed, exclude, start_ngram)
+
+    def _as_compact(self):
+        """A cached CompactMarkovGenerator copy of the model, for vectorised operations."""
+        if self._compact is None:
+            self._compact = CompactMarkovGenerator.from_generator(self)
+            self._compact._consolidate()
+        return self._compact
+
+    def transition_matrix(self, probabilities=True):
+        """The transition table as a SciPy sparse CSR matrix of conditional probabilities (or counts), along with
+        lists of the contexts and symbols that label its rows and columns. Requires scipy."""
+        return self._as_compact().transition_matrix(probabilities)
+
+    def transition_frame(self):
+        """The transition table as a tidy DataFrame, with context, successor, count and probability columns. Requires
+        pandas."""
+        return self._as_compact().transition_frame()
+
+    def top_successors(self, k=1):
+        """The k most common successors of every context, as a tidy DataFrame like transition_frame plus a rank
+        column. Ties are ordered by when the successors were first seen after each context, as in Counter.most_common
+        (or, for compact generators, which don't record this, by symbol id). Requires pandas."""
+        compact = self._as_compact()
+        labels = [compact._decode(int(key)) for key in compact.contexts]
+        seen = {(context, successor): n for context, counter in self.markov_dict.items() for n, successor in enumerate(counter)}
+        ties = np.array([seen[labels[r], compact.symbols[v]] for r, v in zip(compact._entry_rows(), compact.successors)], dtype=np.int64)
+        return compact._top_successors(k, ties)
+
+    def entropies(self, base=2):
+        """The entropy of every context's successor distribution, as a Series indexed by context. Requires pandas."""
+        return self._as_compact().entropies(base)
+
+    def conditional_probabilities(self, ngrams):
+        """The probabilities of a list of (n+1)-grams' last symbols given their contexts, as an array. Unseen
+        transitions have probability 0."""
+        return self._as_compact().conditional_probabilities(ngrams)
+
+    def log_likelihoods(self, sequences):
+        """The (natural) log-likelihood of each of a list of sequences, given their initial contexts, as an array.
+        Sequences containing unseen transitions have log-likelihood -inf."""
+        return self._as_compact().log_likelihoods(sequences)
+
+
+class CompactMarkovGenerator(MarkovGenerator):
+    """Array-backed Markov Chain n-gram-based generator, with the same API as MarkovGenerator but a far smaller memory
+    footprint. Symbols are interned to integer ids, contexts are stored as sorted integer keys packing their symbol ids,
+    and successors are held in CSR-style arrays of symbol ids and (running) cumulative counts. Training is counted in
+    batches, which are merged into the arrays when the model is next used."""
+
+    pending_limit = 2**22
+    file_magic = b"PUDZUMKV"
+    file_version = 1
+    file_arrays = {"contexts": "<i8", "indptr": "<i8", "successors": "<i4", "cumcounts": "<i8"}
+
+    def __init__(self, order, max_contexts=None):
+        """Initialise generator for a given n-gram order, optionally with a budget on the number of contexts to
+        keep during training."""
+        self.n = order
+        self.max_contexts = max_contexts
+        self.symbols = []
+        self.symbol_ids = {}
+        self.bits = 1
+        self.contexts = np.zeros(0, dtype=np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.successors = np.zeros(0, dtype=np.int32)
+        self.cumcounts = np.zeros(0, dtype=np.int64)
+        self._pending = []
+        self.metadata = {}
+        self._start_predicates = set()
+        self._reset_pruning()
+        self._clear_tables()
+
+    @classmethod
+    def from_generator(cls, generator):
+        """Convert a dict-based MarkovGenerator into a compact one."""
+        compact = cls(generator.n)
+        triples = [(ctx, v, c) for ctx, counter in generator.markov_dict.items() for v, c in counter.items()]
+        ids = compact._intern([x for ctx, v, _ in triples for x in (*ctx, v)]).reshape(len(triples), compact.n + 1)
+        bits = compact._symbol_bits()
+        keys = np.zeros(len(triples), dtype=np.int64)
+        for k in range(compact.n):
+            keys = (keys << bits) | ids[:, k]
+        counts = np.fromiter((c for _, _, c in triples), dtype=np.int64, count=len(triples))
+        compact._pending.append((*compact._aggregate(keys, ids[:, compact.n], counts), bits))
+        return compact
+
+    def to_generator(self):
+        """Convert into a dict-based MarkovGenerator."""
+        generator = MarkovGenerator(self.n)
+        generator.markov_dict = {ctx: successors for ctx, successors in self.markov_dict.items()}
+        generator.prob_dict = Counter(self.prob_dict)
+        return generator
+
+    def save(self, path, base=None, **metadata):
+        """Save generator in a binary model format that can be memory-mapped by load. This consists of a magic
+        string, format version and JSON header (recording the generator class, order, symbols, array layout and any
+        additional metadata, such as training parameters), followed by the raw arrays. Symbols must be JSON
+        serialisable. If a base generator (or saved model path) is given, just the counts that have changed since it
+        are saved, as a delta file that can be applied to it by load."""
+        if base is None:
+            return self._write(path, metadata)
+        if isinstance(base, str):
+            base = CompactMarkovGenerator.load(base)
+        elif not isinstance(base, CompactMarkovGenerator):
+            base = CompactMarkovGenerator.from_generator(base)
+        self._difference(base)._write(path, metadata, {"base": base._fingerprint()})
+
+    def _write(self, path, metadata, delta=None):
+        self._consolidate()
+        if json.loads(json.dumps(self.symbols)) != self.symbols:
+            raise TypeError("Only generators with string, number or None symbols can be saved")
+        header = {"class": type(self).__name__, "order": self.n, "bits": self.bits, "symbols": self.symbols, "metadata": metadata, "arrays": {}}
+        layouts, arrays, offset = [header["arrays"]], [], 0
+        if self._backoff():
+            header["backoff"] = [{"order": model.n, "arrays": {}} for model in self._backoff()]
+            layouts += [layout["arrays"] for layout in header["backoff"]]
+        if delta is not None:
+            header["delta"] = delta
+        for model, layout in zip((self, *self._backoff()), layouts):
+            for name, dtype in self.file_arrays.items():
+                array = getattr(model, name).astype(dtype)
+                layout[name] = {"dtype": array.dtype.str, "length": len(array), "offset": offset}
+                arrays.append((offset, array))
+                offset += -(-array.nbytes // 64) * 64
+        encoded = json.dumps(header).encode("utf-8")
+        start = -(-(len(self.file_magic) + 8 + len(encoded)) // 64) * 64
+        with open(path, "wb") as f:
+            f.write(self.file_magic + np.array([self.file_version, len(encoded)], dtype="<u4").tobytes() + encoded)
+            for offset, array in arrays:
+                f.seek(start + offset)
+                f.write(array.tobytes())
+
+    @classmethod
+    def load(cls, path, mmap=True, deltas=()):
+        """Load a generator saved by save, memory-mapping its arrays (read-only, so that pages are shared between
+        processes) unless mmap is False. Any saved metadata is returned in the metadata attribute. Multi-order
+        models are loaded as a MultiOrderMarkovGenerator. Delta files saved against this model (or against the
+        result of applying the previous deltas) can be applied in order."""
+        generator, header = cls._read(path, mmap)
+        if "delta" in header:
+            raise ValueError(f"{path} is a delta file: load its base model with deltas=[{path!r}] instead")
+        for delta_path in deltas:
+            delta, delta_header = cls._read(delta_path, mmap)
+            if "delta" not in delta_header:
+                raise ValueError(f"{delta_path} is not a delta file")
+            if delta_header["delta"]["base"] != generator._fingerprint():
+                raise ValueError(f"{delta_path} was saved against a different base model")
+            generator._update(delta)
+            generator.metadata.update(delta.metadata)
+        return generator
+
+    @classmethod
+    def _read(cls, path, mmap):
+        with open(path, "rb") as f:
+            magic = f.read(len(cls.file_magic))
+            if magic != cls.file_magic:
+                raise ValueError(f"{path} is not a Markov model file")
+            version, length = (int(x) for x in np.frombuffer(f.read(8), dtype="<u4"))
+            if version > cls.file_version:
+                raise ValueError(f"{path} uses model format version {version} (supported up to {cls.file_version})")
+            header = json.loads(f.read(length).decode("utf-8"))
+        start = -(-(len(cls.file_magic) + 8 + length) // 64) * 64
+        classes = {c.__name__: c for c in (CompactMarkovGenerator, MultiOrderMarkovGenerator)}
+        saved = classes.get(header.get("class"), MultiOrderMarkovGenerator if header.get("backoff") else CompactMarkovGenerator)
+        if not issubclass(cls, saved) or issubclass(cls, MultiOrderMarkovGenerator) != issubclass(saved, MultiOrderMarkovGenerator):
+            cls = saved
+        generator = cls(header["order"])
+        generator.metadata = header["metadata"]
+        symbols, symbol_ids = header["symbols"], {s: i for i, s in enumerate(header["symbols"])}
+        models = {model.n: model for model in (generator, *generator._backoff())}
+        for layout in [header, *header.get("backoff", [])]:
+            model = models[layout["order"]]
+            model.symbols, model.symbol_ids, model.bits = symbols, symbol_ids, header["bits"]
+            for name, info in layout["arrays"].items():
+                dtype = np.dtype(info["dtype"])
+                if info["length"] == 0:
+                    array = np.zeros(0, dtype=dtype)
+                elif mmap:
+                    array = np.memmap(path, dtype=dtype, mode="r", offset=start + info["offset"], shape=(info["length"],))
+                else:
+                    with open(path, "rb") as f:
+                        f.seek(start + info["offset"])
+                        array = np.fromfile(f, dtype=dtype, count=info["length"])
+                setattr(model, name, array)
+        return generator, header
+
+    @property
+    def markov_dict(self):
+        """Read-only mapping from contexts to Counters of their successors, equivalent to MarkovGenerator.markov_dict."""
+        self._consolidate()
+        return _CompactSuccessors(self)
+
+    @property
+    def prob_dict(self):
+        """Read-only mapping from contexts to their counts, equivalent to MarkovGenerator.prob_dict."""
+        self._consolidate()
+        return _CompactContexts(self)
+
+    def _symbol_bits(self):
+        bits = max(1, (len(self.symbols) - 1).bit_length())
+        if bits * self.n > 63:
+            raise OverflowError(f"Too many symbols ({len(self.symbols)}) to pack order {self.n} contexts into 64 bits")
+        return bits
+
+    def _intern(self, symbols):
+        ids = self.symbol_ids
+        for s in symbols:
+            if s not in ids:
+                ids[s] = len(self.symbols)
+                self.symbols.append(s)
+        return np.fromiter(map(ids.__getitem__, symbols), dtype=np.int64, count=len(symbols))
+
+    def _repack(self, keys, old_bits, new_bits):
+        """Repack context keys for a larger symbol id width."""
+        if old_bits == new_bits:
+            return keys
+        repacked = np.zeros(len(keys), dtype=np.int64)
+        for k in range(self.n):
+            repacked = (repacked << new_bits) | ((keys >> (old_bits * (self.n - 1 - k))) & ((1 << old_bits) - 1))
+        return repacked
+
+    @staticmethod
+    def _aggregate(keys, successors, counts):
+        """Sort (context, successor, count) triples, summing the counts of duplicates."""
+        order = np.lexsort((successors, keys))
+        keys, successors, counts = keys[order], successors[order], counts[order]
+        if len(keys):
+            starts = np.flatnonzero(np.concatenate([[True], (keys[1:] != keys[:-1]) | (successors[1:] != successors[:-1])]))
+            keys, successors, counts = keys[starts], successors[starts], np.add.reduceat(counts, starts)
+        return keys, successors, counts
+
+    def _consolidate(self):
+        """Merge any pending training counts into the arrays, and repack them if the symbol table has grown."""
+        bits = self._symbol_bits()
+        if not self._pending and bits == self.bits:
+            return
+        current = (np.repeat(self.contexts, np.diff(self.indptr)), self.successors, np.diff(self.cumcounts, prepend=0), self.bits)
+        parts = [(self._repack(keys, b, bits), successors.astype(np.int64), counts) for keys, successors, counts, b in [current, *self._pending]]
+        keys, successors, counts = self._aggregate(*(np.concatenate(a) for a in zip(*parts)))
+        rows = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]])) if len(keys) else np.zeros(0, dtype=np.int64)
+        previous = self._repack(self.contexts, self.bits, bits)
+        self.contexts, self.indptr = keys[rows], np.append(rows, len(keys))
+        self.successors, self.cumcounts = successors.astype(np.int32), np.cumsum(counts)
+        self.bits, self._pending = bits, []
+        if self._threshold:
+            # contexts first seen since the last consolidation may have been pruned before
+            positions = np.minimum(np.searchsorted(previous, self.contexts), max(len(previous) - 1, 0))
+            seen = (previous[positions] == self.contexts) if len(previous) else np.zeros(len(self.contexts), dtype=bool)
+            undercounts = self._undercounts[positions] if self._undercounts is not None and len(previous) else 0
+            self._undercounts = np.where(seen, undercounts, self._threshold)
+        if self.max_contexts is not None and len(self.contexts) > self.max_contexts:
+            self._prune()
+        self._clear_tables()
+
+    def _reset_pruning(self):
+        super()._reset_pruning()
+        self._undercounts = None
+
+    def _prune(self):
+        totals = self._totals()
+        scores = totals + np.maximum(self._floor, 0 if self._undercounts is None else self._undercounts)
+        excess = len(scores) - int(self.max_contexts * self.prune_target)
+        if excess > 0:
+            self._threshold = max(self._threshold, int(np.partition(scores, excess - 1)[excess - 1]))
+        keep = scores > self._threshold
+        self._pruned["contexts"] += int(len(keep) - keep.sum())
+        self._pruned["count"] += int(totals[~keep].sum())
+        entries = np.repeat(keep, np.diff(self.indptr))
+        self.contexts, self.indptr = self.contexts[keep], np.append(0, np.cumsum(np.diff(self.indptr)[keep]))
+        self.successors, self.cumcounts = self.successors[entries], np.cumsum(np.diff(self.cumcounts, prepend=0)[entries])
+        self._undercounts = None if self._undercounts is None else self._undercounts[keep]
+        logger.info(f"Pruned contexts with counts up to {self._threshold}, leaving {len(self.contexts)}")
+
+    def _total(self):
+        self._consolidate()
+        return int(self.cumcounts[-1]) if len(self.cumcounts) else 0
+
+    def _uncertain(self):
+        self._consolidate()
+        return len(self.contexts) if self._floor else 0 if self._undercounts is None else int(np.count_nonzero(self._undercounts))
+
+    def _update(self, other):
+        """Add another generator's counts to this one."""
+        self._add_pending(self._triples(other))
+        self._merge_pruning(other)
+        self._clear_tables()
+
+    def _triples(self, other):
+        """Another generator's (context key, successor id, count) arrays, in terms of this one's symbol ids, plus
+        the symbol id width used for the keys."""
+        if not isinstance(other, CompactMarkovGenerator):
+            other = CompactMarkovGenerator.from_generator(other)
+        other._consolidate()
+        ids = self._intern(other.symbols)
+        bits = self._symbol_bits()
+        contexts = np.zeros(len(other.contexts), dtype=np.int64)
+        for k in range(self.n):
+            contexts = (contexts << bits) | ids[(other.contexts >> (other.bits * (self.n - 1 - k))) & ((1 << other.bits) - 1)]
+        keys = np.repeat(contexts, np.diff(other.indptr))
+        return keys, ids[other.successors], np.diff(other.cumcounts, prepend=0), bits
+
+    def _difference(self, base):
+        """A generator of the same type containing just the counts that have increased since a base generator."""
+        self._consolidate()
+        models, base_models = (self, *self._backoff()), (base, *base._backoff())
+        if base.n != self.n or [m.n for m in models] != [m.n for m in base_models]:
+            raise ValueError("Base generator has different orders")
+        if any(s not in self.symbol_ids for s in base.symbols):
+            raise ValueError("Base generator has symbols that this one doesn't")
+        difference = type(self)(self.n)
+        difference._intern(self.symbols)
+        for model, base_model, delta in zip(models, base_models, (difference, *difference._backoff())):
+            keys, successors, counts, bits = model._triples(base_model)
+            current = (np.repeat(model.contexts, np.diff(model.indptr)), model.successors.astype(np.int64), np.diff(model.cumcounts, prepend=0))
+            keys, successors, counts = self._aggregate(
+                np.concatenate([current[0], keys]), np.concatenate([current[1], successors]), np.concatenate([current[2], -counts])
+            )
+            if (counts < 0).any():
+                raise ValueError("Base generator has counts that this one doesn't")
+            changed = counts > 0
+            delta._pending.append((keys[changed], successors[changed], counts[changed], bits))
+        return difference
+
+    def _fingerprint(self):
+        """Number of contexts and total count for each order, used to check that deltas are applied to the right base."""
+        self._consolidate()
+        return [[len(m.contexts), int(m.cumcounts[-1]) if len(m.cumcounts) else 0] for m in (self, *self._backoff())]
+
+    def train(self, iterable, chunk_size=2**20):
+        """Train generator on an iterable, which is read in chunks of the given size (or of the max_contexts budget,
+        if that's smaller)."""
+        symbols, tail = iter(iterable), []
+        chunk_size = chunk_size if self.max_contexts is None else min(chunk_size, self.max_contexts)
+        while True:
+            chunk = tail + list(itertools.islice(symbols, chunk_size))
+            if len(chunk) == len(tail):
+                break
+            ids = self._intern(chunk)
+            for model in (self, *self._backoff()):
+                model._count(ids, len(tail))
+            tail = chunk[max(len(chunk) - self.n, 0) :]
+
+    def _train_boundary(self, tail, overlap):
+        ids = self._intern(tail + overlap)
+        for model in (self, *self._backoff()):
+            model._count(ids[max(len(tail) - model.n, 0) : len(tail) + model.n], 0)
+
+    def _count(self, ids, start):
+        """Count the n-grams in an array of symbol ids that end at or after a given position."""
+        first = max(start, self.n)
+        m = len(ids) - first
+        if m > 0:
+            bits = self._symbol_bits()
+            keys = np.zeros(m, dtype=np.int64)
+            for k in range(self.n):
+                keys = (keys << bits) | ids[first - self.n + k : first - self.n + k + m]
+            self._add_pending((*self._aggregate(keys, ids[first:], np.ones(m, dtype=np.int64)), bits))
+
+    def _add_pending(self, triples):
+        """Add a batch of training counts, merging the pending batches into the arrays once they hold more than
+        pending_limit transitions (or more than the max_contexts budget, if that's smaller)."""
+        self._pending.append(triples)
+        limit = self.pending_limit if self.max_contexts is None else min(self.pending_limit, self.max_contexts)
+        if sum(len(p[0]) for p in self._pending) > limit:
+            self._consolidate()
+
+    def _backoff(self):
+        """Lower-order models to back off to when a context is unseen, from highest to lowest order."""
+        return ()
+
+    def _decode(self, key):
+        mask = (1 << self.bits) - 1
+        return tuple(self.symbols[(key >> (self.bits * (self.n - 1 - k))) & mask] for k in range(self.n))
+
+    def _key(self, ngram):
+        """The packed key of a context, or None if it contains unknown symbols."""
+        key = 0
+        for s in ngram:
+            if s not in self.symbol_ids:
+                return None
+            key = (key << self.bits) | self.symbol_ids[s]
+        return key
+
+    def _row(self, key):
+        """The row of a context key, or None if it's not present."""
+        i = bisect.bisect_left(self.contexts, key)
+        return i if i < len(self.contexts) and self.contexts[i] == key else None
+
+    def _lookup(self, keys):
+        """The rows of an array of context keys, along with a mask of which ones are present."""
+        rows = np.searchsorted(self.contexts, keys)
+        if len(self.contexts) == 0:
+            return rows, np.zeros(len(keys), dtype=bool)
+        return rows, (rows < len(self.contexts)) & (self.contexts[np.minimum(rows, len(self.contexts) - 1)] == keys)
+
+    def _make_start_table(self, key):
+        ends = self.cumcounts[self.indptr[1:] - 1]
+        if key is None:
+            return CumulativeTable(np.arange(len(self.contexts)), ends)
+        elif isinstance(key, StartsWith):
+            if self.n == 0 or key.symbol not in self.symbol_ids:
+                return CumulativeTable([], [])
+            shift = self.bits * (self.n - 1)
+            lo, hi = np.searchsorted(self.contexts, [self.symbol_ids[key.symbol] << shift, (self.symbol_ids[key.symbol] + 1) << shift])
+            return CumulativeTable(np.arange(lo, hi), ends[lo:hi] - (ends[lo - 1] if lo else 0))
+        elif callable(key):
+            rows = np.flatnonzero([bool(key(self._decode(int(context)))) for context in self.contexts])
+            return CumulativeTable(rows, np.cumsum(np.diff(ends, prepend=0)[rows]))
+        packed = self._key(key) if len(key) == self.n else None
+        row = None if packed is None else self._row(packed)
+        return CumulativeTable([] if row is None else [row], [1])
+
+    def _random_successor(self, row):
+        start, end = int(self.indptr[row]), int(self.indptr[row + 1])
+        low = self.cumcounts[start - 1] if start else 0
+        return int(self.successors[bisect.bisect_left(self.cumcounts, random.uniform(low, self.cumcounts[end - 1]), start, end)])
+
+    def _successor_ids(self, rows, uniform):
+        """Successor ids for an array of rows, chosen using an array of uniform random values in [0, 1)."""
+        starts, high = self.indptr[rows], self.cumcounts[self.indptr[rows + 1] - 1]
+        low = np.where(starts > 0, self.cumcounts[starts - 1], 0)
+        return self.successors[np.searchsorted(self.cumcounts, low + uniform * (high - low), side="right")].astype(np.int64)
+
+    def render(self, stop_when, start_ngram=None):
+        """Return a tuple using the trained probabilities. Stop condition can be a maximum length or function."""
+        self._consolidate()
+        stop_fn = stop_when if callable(stop_when) else lambda o: len(o) >= stop_when
+        row = int(self._start_table(start_ngram).sample())
+        key, mask = int(self.contexts[row]), (1 << (self.bits * self.n)) - 1
+        output, models = self._decode(key), (self, *self._backoff())
+        while not stop_fn(output):
+            for model in models:
+                row = model._row(key & ((1 << (self.bits * model.n)) - 1))
+                if row is not None:
+                    break
+            else:
+                model, row = self, int(self._start_table(None).sample())
+                key = int(self.contexts[row])
+            v = model._random_successor(row)
+            output += (self.symbols[v],)
+            key = ((key << self.bits) | v) & mask
+        return output
+
+    def render_many(self, number, stop_when=" ", min_length=3, max_length=12, seed=None, exclude=(), start_ngram=None):
+        """Generate many outputs at once, advancing the chains in lockstep using NumPy. If stop_when is a symbol, returns
+        words like render_word: chains start from contexts beginning with that symbol and stop when they generate it
+        again, and are kept if their stripped length is between min_length and max_length and they're not in exclude.
+        If stop_when is an integer, returns tuples like render. Output is reproducible for a given seed."""
+        self._consolidate()
+        rng, results = np.random.default_rng(seed), []
+        words = not isinstance(stop_when, int)
+        if words and start_ngram is None:
+            start_ngram = StartsWith(stop_when)
+        starts, everything = self._start_table(start_ngram), self._start_table(None)
+        symbols, exclude = np.array(self.symbols + [None], dtype=object), set(exclude)
+        while len(results) < number:
+            batch = max(16, 2 * (number - len(results)))
+            lengths, output = self._render_batch(rng, batch, starts, everything, stop_when, max_length)
+            for length, ids in zip(lengths, output):
+                if not words:
+                    results.append(tuple(symbols[ids[:length]]))
+                elif length > 0:
+                    word = "".join(symbols[ids[:length]]).strip()
+                    if min_length <= len(word) <= max_length and word not in exclude:
+                        results.append(word)
+                if len(results) == number:
+                    break
+        return results
+
+    def _render_batch(self, rng, batch, starts, everything, stop_when, max_length):
+        """Render a batch of chains in lockstep, returning their lengths (0 for abandoned chains) and symbol ids."""
+        n, bits, mask = self.n, self.bits, (1 << (self.bits * self.n)) - 1
+        models = (self, *self._backoff())
+
+        def sample(table, size):
+            keys, cumulative = np.asarray(table.keys), np.asarray(table.cumulative)
+            return keys[np.searchsorted(cumulative, rng.random(size) * cumulative[-1], side="right")]
+
+        words = not isinstance(stop_when, int)
+        steps = max_length + 1 if words else max(stop_when - n, 0)
+        stop = self.symbol_ids.get(stop_when, -1) if words else -1
+        keys = self.contexts[sample(starts, batch)]
+        output = np.full((batch, n + steps), len(self.symbols), dtype=np.int64)
+        for k in range(n):
+            output[:, k] = (keys >> (bits * (n - 1 - k))) & ((1 << bits) - 1)
+        lengths = np.full(batch, n)
+        done = (n > 1) & (output[:, n - 1] == stop) if n else np.zeros(batch, dtype=bool)
+        active = np.flatnonzero(~done)
+        for step in range(steps):
+            if len(active) == 0:
+                break
+            context, rows = keys[active], np.zeros(len(active), dtype=np.int64)
+            unseen, found = np.arange(len(active)), []
+            for model in models:
+                model_rows, present = model._lookup(context[unseen] & ((1 << (bits * model.n)) - 1))
+                rows[unseen[present]] = model_rows[present]
+                found.append(unseen[present])
+                unseen = unseen[~present]
+            if len(unseen):
+                rows[unseen] = sample(everything, len(unseen))
+                context[unseen] = self.contexts[rows[unseen]]
+                found[0] = np.concatenate([found[0], unseen])
+            uniform, successors = rng.random(len(active)), np.zeros(len(active), dtype=np.int64)
+            for model, i in zip(models, found):
+                successors[i] = model._successor_ids(rows[i], uniform[i])
+            output[active, n + step] = successors
+            lengths[active] += 1
+            keys[active] = ((context << bits) | successors) & mask
+            active = active[successors != stop]
+        if words:
+            lengths[active] = 0
+        return lengths, output
+
+    def _as_compact(self):
+        self._consolidate()
+        return self
+
+    def _totals(self):
+        """The total successor count of each context."""
+        return np.diff(self.cumcounts[self.indptr[1:] - 1], prepend=0)
+
+    def _entry_rows(self):
+        """The context row of each successor entry."""
+        return np.repeat(np.arange(len(self.contexts)), np.diff(self.indptr))
+
+    def _frame(self, entries):
+        """Tidy DataFrame of the given successor entries."""
+        rows, counts = self._entry_rows()[entries], np.diff(self.cumcounts, prepend=0)[entries]
+        labels = [self._decode(int(key)) for key in self.contexts]
+        return pd.DataFrame(
+            {
+                "context": [labels[r] for r in rows],
+                "successor": [self.symbols[v] for v in self.successors[entries]],
+                "count": counts,
+                "probability": counts / self._totals()[rows],
+            }
+        )
+
+    def transition_matrix(self, probabilities=True):
+        self._consolidate()
+        counts = np.diff(self.cumcounts, prepend=0)
+        data = counts / self._totals()[self._entry_rows()] if probabilities else counts
+        matrix = sparse.csr_matrix((data, self.successors, self.indptr), shape=(len(self.contexts), len(self.symbols)))
+        return matrix, [self._decode(int(key)) for key in self.contexts], list(self.symbols)
+
+    def transition_frame(self):
+        self._consolidate()
+        return self._frame(np.arange(len(self.successors)))
+
+    def top_successors(self, k=1):
+        self._consolidate()
+        return self._top_successors(k, self.successors)
+
+    def _top_successors(self, k, ties):
+        """The k most common successors of every context, ordering ties by the given per-entry values."""
+        rows = self._entry_rows()
+        order = np.lexsort((ties, -np.diff(self.cumcounts, prepend=0), rows))
+        ranks = np.arange(len(order)) - self.indptr[rows[order]]
+        frame = self._frame(order[ranks < k])
+        frame.insert(1, "rank", ranks[ranks < k])
+        return frame
+
+    def entropies(self, base=2):
+        self._consolidate()
+        labels = pd.Index([self._decode(int(key)) for key in self.contexts], tupleize_cols=False)
+        if len(self.contexts) == 0:
+            return pd.Series([], index=labels, dtype=float, name="entropy")
+        p = np.diff(self.cumcounts, prepend=0) / self._totals()[self._entry_rows()]
+        return pd.Series(-np.add.reduceat(p * np.log(p), self.indptr[:-1]) / np.log(base), index=labels, name="entropy")
+
+    def _transitions(self, ngrams):
+        """The successor entries of a list of (n+1)-grams, or -1 for unseen transitions."""
+        ngrams = [tuple(ngram) for ngram in ngrams]
+        if any(len(ngram) != self.n + 1 for ngram in ngrams):
+            raise ValueError(f"Transitions must have length {self.n + 1}")
+        self._consolidate()
+        ids = np.array([[self.symbol_ids.get(s, -1) for s in ngram] for ngram in ngrams], dtype=np.int64).reshape(len(ngrams), self.n + 1)
+        known = (ids >= 0).all(axis=1)
+        ids[ids < 0] = 0
+        keys = np.zeros(len(ngrams), dtype=np.int64)
+        for k in range(self.n):
+            keys = (keys << self.bits) | ids[:, k]
+        rows, present = self._lookup(keys)
+        entries = self._entry_rows() * len(self.symbols) + self.successors
+        queries = rows * len(self.symbols) + ids[:, self.n]
+        found = np.searchsorted(entries, queries)
+        present &= known & (found < len(entries))
+        present[present] = entries[found[present]] == queries[present]
+        return np.where(present, found, -1)
+
+    def conditional_probabilities(self, ngrams):
+        entries = self._transitions(ngrams)
+        seen = entries >= 0
+        probabilities = np.zeros(len(entries))
+        probabilities[seen] = np.diff(self.cumcounts, prepend=0)[entries[seen]] / self._totals()[self._entry_rows()[entries[seen]]]
+        return probabilities
+
+    def log_likelihoods(self, sequences):
+        sequences = [tuple(sequence) for sequence in sequences]
+        ngrams = [ngram for sequence in sequences for ngram in generate_ngrams(sequence, self.n + 1)]
+        owners = np.repeat(np.arange(len(sequences)), [max(len(sequence) - self.n, 0) for sequence in sequences])
+        with np.errstate(divide="ignore"):
+            logs = np.log(self.conditional_probabilities(ngrams))
+        return np.bincount(owners, weights=logs, minlength=len(sequences))
+
+
+class MultiOrderMarkovGenerator(CompactMarkovGenerator):
+    """Compact generator that also counts every lower order (from 1 up) in the same pass over the training data,
+    sharing a single symbol table. The highest order is used directly, as in CompactMarkovGenerator, but rendering
+    backs off to the highest lower order with a matching context whenever a context is unseen. Each order's model
+    can be queried via orders."""
+
+    def __init__(self, order, max_contexts=None):
+        """Initialise generator for a given maximum n-gram order, optionally with a budget on the number of contexts
+        to keep for each order during training."""
+        super().__init__(order, max_contexts)
+        self.lower = {k: CompactMarkovGenerator(k, max_contexts) for k in range(1, order)}
+        for model in self.lower.values():
+            model.symbols, model.symbol_ids = self.symbols, self.symbol_ids
+
+    @property
+    def orders(self):
+        """Dict of the compact models for each order, from 1 up to (and including) this one."""
+        return {**self.lower, self.n: self}
+
+    def _backoff(self):
+        return tuple(self.lower[k] for k in sorted(self.lower, reverse=True))
+
+    def _consolidate(self):
+        super()._consolidate()
+        for model in self.lower.values():
+            model._consolidate()
+
+    def _update(self, other):
+        if not isinstance(other, MultiOrderMarkovGenerator):
+            raise ValueError("Multi-order generators can only be merged with other multi-order generators")
+        super()._update(other)
+        for k, model in self.lower.items():
+            model._update(other.lower[k])
+
+
+class _CompactSuccessors(abc.Mapping):
+    """Read-only markov_dict view of a CompactMarkovGenerator."""
+
+    def __init__(self, generator):
+        self.generator = generator
+
+    def __getitem__(self, ngram):
+        g = self.generator
+        key = g._key(ngram) if len(ngram) == g.n else None
+        row = None if key is None else g._row(key)
+        if row is None:
+            raise KeyError(ngram)
+        start, end = g.indptr[row], g.indptr[row + 1]
+        counts = np.diff(g.cumcounts[start:end], prepend=g.cumcounts[start - 1] if start else 0)
+        return Counter({g.symbols[v]: int(c) for v, c in zip(g.successors[start:end], counts)})
+
+    def __iter__(self):
+        return (self.generator._decode(int(key)) for key in self.generator.contexts)
+
+    def __len__(self):
+        return len(self.generator.contexts)
+
+
+class _CompactContexts(_CompactSuccessors):
+    """Read-only prob_dict view of a CompactMarkovGenerator."""
+
+    def __getitem__(self, ngram):
+        g = self.generator
+        key = g._key(ngram) if len(ngram) == g.n else None
+        row = None if key is None else g._row(key)
+        if row is None:
+            raise KeyError(ngram)
+        start, end = g.indptr[row], g.indptr[row + 1]
+        return int(g.cumcounts[end - 1] - (g.cumcounts[start - 1] if start else 0))
+
+
+def _shard_boundaries(filename, shards):
+    """Byte offsets splitting a file into roughly equal shards at line boundaries."""
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, "rb") as f:
+        for i in range(1, shards):
+            f.seek(max(size * i // shards, bounds[-1]))
+            f.readline()
+            if f.tell() >= size:
+                break
+            if f.tell() > bounds[-1]:
+                bounds.append(f.tell())
+    return bounds + [size]
+
+
+def _train_shard(cls, order, max_contexts, filename, encoding, convert, normalise, start, end):
+    """Train a generator on one shard of a file, plus the n-grams that start in the shard but end in the first order
+    symbols of the rest of the file, so that n-grams straddling the boundary are counted once, by the shard they
+    start in."""
+    generator, tail = cls(order, max_contexts), deque(maxlen=order)
+    with open(filename, "rb") as f:
+        f.seek(start)
+        shard = io.TextIOWrapper(io.BytesIO(f.read(end - start)), encoding=encoding)
+        rest = io.TextIOWrapper(f, encoding=encoding)
+        generator.train(tail.append(symbol) or symbol for symbol in normalise(convert(shard)))
+        generator._train_boundary(list(tail), list(itertools.islice(normalise(convert(rest)), order)))
+    if isinstance(generator, CompactMarkovGenerator):
+        generator._consolidate()
+    return generator
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate pseudowords using Markov chains")
@@ -93,21 +1022,26 @@ if __name__ == "__main__":
     parser.add_argument("-l", "--letters", type=str, help="letters to keep [a-z/A-Z]", default=string.ascii_letters)
     parser.add_argument("-c", "--casesensitive", action="store_true", help="case sensitive generator [False]")
     parser.add_argument("-r", "--regenerate", action="store_true", help="always regenerate generator [False]")
+    parser.add_argument("-w", "--workers", type=int, help="number of parallel training processes [None]", default=None)
+    parser.add_argument("-s", "--seed", type=int, help="random seed for word generation [None]", default=None)
     args = parser.parse_args()
 
-    pickled_dict = "{}_{}.p".format(args.corpus, args.order)
+    model_file = "{}_{}.mkv".format(args.corpus, args.order)
+    parameters = {"letters": args.letters, "casesensitive": args.casesensitive}
     try:
         if args.regenerate:
             raise FileNotFoundError
-        print("Checking for cached generator at {}".format(pickled_dict), file=sys.stderr)
-        with open(pickled_dict, "rb") as f:
-            mk = pickle.load(f)
+        print("Checking for cached generator at {}".format(model_file), file=sys.stderr)
+        mk = CompactMarkovGenerator.load(model_file)
+        if mk.metadata != parameters:
+            print("Cached generator was trained with different parameters.", file=sys.stderr)
+            raise FileNotFoundError
     except FileNotFoundError:
         print("Training from corpus (may take a while).", file=sys.stderr)
-        mk = MarkovGenerator(order=args.order)
-        mk.train_file(args.corpus, normalise=functools.partial(latin_normalise, letters=args.letters + " ", lowercase=not args.casesensitive))
-        print("Saving generated generator to {}".format(pickled_dict), file=sys.stderr)
-        with open(pickled_dict, "wb") as f:
-            pickle.dump(mk, f, pickle.HIGHEST_PROTOCOL)
-    for i in range(args.number):
-        print(mk.render_word())
+        mk = CompactMarkovGenerator(order=args.order)
+        normalise = functools.partial(latin_normalise, letters=args.letters + " ", lowercase=not args.casesensitive)
+        mk.train_file(args.corpus, normalise=normalise, workers=args.workers)
+        print("Saving generated generator to {}".format(model_file), file=sys.stderr)
+        mk.save(model_file, **parameters)
+    for word in mk.render_many(args.number, seed=args.seed):
+        print(word)